@@ -1,18 +1,579 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import bisect
+import heapq
+import itertools
 import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
 import uuid
 import requests
+from array import array
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime
 from fastapi import Path
 from fastapi import FastAPI, Path
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+
+try:
+    import numpy as np
+except ImportError:  # sem NumPy as distâncias são calculadas em Python puro
+    np = None
 
 app = FastAPI()
 
+class SQLiteStore:
+    COLUMNS = {
+        "id_usuario": "TEXT",
+        "email": "TEXT",
+        "nome_da_cidade": "TEXT",
+        "origem": "TEXT",
+        "destino": "TEXT",
+        "nota": "REAL",
+    }
+
+    def __init__(self, db_file="viagens.db"):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS colecoes_importadas (nome TEXT PRIMARY KEY)")
+        self._conn.commit()
+
+    def register(self, manager):
+        table = manager.collection
+        with self._lock, self._conn:
+            column_definitions = ", ".join(f"{column} {kind}" for column, kind in self.COLUMNS.items())
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f"id INTEGER PRIMARY KEY AUTOINCREMENT, {column_definitions}, "
+                "documento TEXT NOT NULL)"
+            )
+            self._add_missing_columns(manager)
+            for columns in manager.indexed_columns:
+                index_name = f"idx_{table}_{'_'.join(columns)}"
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})")
+
+            # Na primeira vez os registros do arquivo JSON são importados para o banco
+            imported = self._conn.execute("SELECT 1 FROM colecoes_importadas WHERE nome = ?", (table,)).fetchone()
+            if imported is None:
+                for record in manager.records_from_document(manager._load_file()):
+                    self._insert(manager, record)
+                self._conn.execute("INSERT INTO colecoes_importadas (nome) VALUES (?)", (table,))
+
+    def _add_missing_columns(self, manager):
+        # Bancos criados antes de uma coluna existir: adiciona a coluna e preenche as linhas
+        table = manager.collection
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        missing = [column for column in self.COLUMNS if column not in existing]
+        if not missing:
+            return
+        for column in missing:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {self.COLUMNS[column]}")
+        assignments = ", ".join(f"{column} = ?" for column in self.COLUMNS)
+        for row_id, document in self._conn.execute(f"SELECT id, documento FROM {table}").fetchall():
+            values = self._row_values(manager, json.loads(document))
+            self._conn.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", values + [row_id])
+
+    def _row_values(self, manager, record):
+        columns = manager.index_columns(record)
+        return [columns.get(column) for column in self.COLUMNS]
+
+    def _where(self, filters):
+        for column in filters:
+            if column not in self.COLUMNS:
+                raise ValueError(f"Coluna sem índice: {column}")
+        if not filters:
+            return "", []
+        return " WHERE " + " AND ".join(f"{column} = ?" for column in filters), list(filters.values())
+
+    def _insert(self, manager, record):
+        self._conn.execute(
+            f"INSERT INTO {manager.collection} ({', '.join(self.COLUMNS)}, documento) "
+            f"VALUES ({', '.join('?' for _ in self.COLUMNS)}, ?)",
+            self._row_values(manager, record) + [json.dumps(record, ensure_ascii=False)],
+        )
+
+    def select(self, manager, order_by_desc=None, limit=None, **filters):
+        where, params = self._where(filters)
+        sql = f"SELECT documento FROM {manager.collection}{where}"
+        if order_by_desc is not None:
+            if order_by_desc not in self.COLUMNS:
+                raise ValueError(f"Coluna sem índice: {order_by_desc}")
+            sql += f" ORDER BY {order_by_desc} DESC, id"
+        else:
+            sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def insert(self, manager, record):
+        with self._lock, self._conn:
+            manager.validate_record(record)
+            self._insert(manager, record)
+
+    def update(self, manager, record, **filters):
+        where, params = self._where(filters)
+        assignments = ", ".join(f"{column} = ?" for column in self.COLUMNS)
+        with self._lock, self._conn:
+            manager.validate_record(record)
+            self._conn.execute(
+                f"UPDATE {manager.collection} SET {assignments}, documento = ?{where}",
+                self._row_values(manager, record) + [json.dumps(record, ensure_ascii=False)] + params,
+            )
+
+    def delete(self, manager, **filters):
+        where, params = self._where(filters)
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {manager.collection}{where}", params)
+
+    def read_document(self, manager):
+        return manager.document_from_records(self.select(manager))
+
+    def write_document(self, manager, data):
+        # Só as linhas que realmente mudaram são removidas/inseridas
+        with self._lock, self._conn:
+            existing = {}
+            for row_id, document in self._conn.execute(f"SELECT id, documento FROM {manager.collection} ORDER BY id"):
+                existing.setdefault(document, []).append(row_id)
+
+            for record in manager.records_from_document(data):
+                document = json.dumps(record, ensure_ascii=False)
+                if existing.get(document):
+                    existing[document].pop(0)
+                else:
+                    self._insert(manager, record)
+
+            stale = [(row_id,) for row_ids in existing.values() for row_id in row_ids]
+            self._conn.executemany(f"DELETE FROM {manager.collection} WHERE id = ?", stale)
+
+class UniqueIndex:
+    # Índice em memória chave -> registro, mantido a cada inserção/alteração/remoção
+    def __init__(self, key):
+        self.key = key
+        self.entries = {}
+
+    def rebuild(self, records):
+        self.entries = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        key = self.key(record)
+        if key is not None:
+            self.entries[key] = record
+
+    def remove(self, record):
+        key = self.key(record)
+        if self.entries.get(key) is record:
+            del self.entries[key]
+
+    def lookup(self, key):
+        record = self.entries.get(key)
+        return [record] if record is not None else []
+
+class SortedIndex:
+    # Índice chave -> registros ordenados por sort_key, mais a lista geral ordenada;
+    # inserções e remoções usam busca binária em vez de reordenar
+    def __init__(self, key, sort_key):
+        self.key = key
+        self.sort_key = sort_key
+        self.groups = {}
+        self.ordered = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def rebuild(self, records):
+        self.groups = {}
+        self.ordered = []
+        self._entries = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        # A sequência desempata valores iguais pela ordem de inserção
+        entry = (self.sort_key(record), next(self._counter), record)
+        self._entries[id(record)] = entry
+        bisect.insort(self.ordered, entry)
+        key = self.key(record)
+        if key is not None:
+            bisect.insort(self.groups.setdefault(key, []), entry)
+
+    def remove(self, record):
+        entry = self._entries.pop(id(record), None)
+        if entry is None:
+            return
+        self._discard(self.ordered, entry)
+        key = self.key(record)
+        group = self.groups.get(key)
+        if group is not None:
+            self._discard(group, entry)
+            if not group:
+                del self.groups[key]
+
+    @staticmethod
+    def _discard(entries, entry):
+        position = bisect.bisect_left(entries, entry[:2])
+        if position < len(entries) and entries[position][1] == entry[1]:
+            del entries[position]
+
+    def lookup(self, key):
+        return [entry[2] for entry in self.groups.get(key, [])]
+
+    def range(self, key, low=None, high=None):
+        entries = self.groups.get(key, [])
+        start = bisect.bisect_left(entries, (low,)) if low is not None else 0
+        end = bisect.bisect_right(entries, (high, math.inf)) if high is not None else len(entries)
+        return [entry[2] for entry in entries[start:end]]
+
+class RankedIndex(SortedIndex):
+    # Registros ordenados pela pontuação, da maior para a menor; order_by_desc diz
+    # qual coluna a pontuação representa, para find_records não reordenar
+    def __init__(self, key, score, order_by_desc=None):
+        super().__init__(key, lambda record: -score(record))
+        self.order_by_desc = order_by_desc
+
+    def best(self):
+        return self.ordered[0][2] if self.ordered else None
+
+class RouteGraph:
+    # Grafo de voos origem -> destino (cidades normalizadas). Cada trecho guarda seus
+    # voos ordenados por valor_voo; o peso do trecho é o voo mais barato
+    def __init__(self):
+        self.adjacency = {}
+        self.names = {}
+        self._entries = {}
+        self._counter = itertools.count()
+        self._alcance = {}
+
+    def rebuild(self, records):
+        self.adjacency = {}
+        self.names = {}
+        self._entries = {}
+        self._alcance = {}
+        for record in records:
+            self.add(record)
+
+    @staticmethod
+    def _edge(voo):
+        origem, destino, valor = voo.get("origem"), voo.get("destino"), voo.get("valor_voo")
+        if not isinstance(origem, str) or not isinstance(destino, str):
+            return None
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)) or valor < 0:
+            return None
+        origem, destino = normalizar_cidade(origem), normalizar_cidade(destino)
+        if not origem or not destino or origem == destino:
+            return None
+        return origem, destino
+
+    def add(self, voo):
+        edge = self._edge(voo)
+        if edge is None:
+            return
+        entry = (voo["valor_voo"], next(self._counter), voo)
+        self._entries[id(voo)] = (edge, entry)
+        voos = self.adjacency.setdefault(edge[0], {}).setdefault(edge[1], [])
+        bisect.insort(voos, entry)
+        if voos[0] is entry:
+            self._invalidar_alcance(edge[0])
+        self.names.setdefault(edge[0], voo["origem"])
+        self.names.setdefault(edge[1], voo["destino"])
+
+    def remove(self, voo):
+        edge, entry = self._entries.pop(id(voo), (None, None))
+        if edge is None:
+            return
+        voos = self.adjacency[edge[0]][edge[1]]
+        if voos[0] is entry:
+            self._invalidar_alcance(edge[0])
+        SortedIndex._discard(voos, entry)
+        if not voos:
+            del self.adjacency[edge[0]][edge[1]]
+            if not self.adjacency[edge[0]]:
+                del self.adjacency[edge[0]]
+
+    def peso(self, origem, destino):
+        return self.adjacency[origem][destino][0][0]
+
+    def mais_barata(self, origem, destino, max_trechos, arestas_bloqueadas=(), nos_bloqueados=()):
+        # Dijkstra sobre (cidade, trechos usados); um rótulo só é expandido se usa menos
+        # trechos que todos os já fechados naquela cidade, que custaram menos
+        fila = [(0, 0, (origem,))]
+        menos_trechos = {}
+        while fila:
+            custo, trechos, caminho = heapq.heappop(fila)
+            cidade = caminho[-1]
+            if cidade == destino:
+                return custo, list(caminho)
+            if menos_trechos.get(cidade, math.inf) <= trechos:
+                continue
+            menos_trechos[cidade] = trechos
+            if trechos == max_trechos:
+                continue
+            for proxima, voos in self.adjacency.get(cidade, {}).items():
+                if proxima in caminho or proxima in nos_bloqueados or (cidade, proxima) in arestas_bloqueadas:
+                    continue
+                heapq.heappush(fila, (custo + voos[0][0], trechos + 1, caminho + (proxima,)))
+        return None
+
+    def _invalidar_alcance(self, cidade):
+        # Um trecho que ficou mais barato (ou caro) saindo de cidade só muda as buscas
+        # que alcançavam essa cidade dentro do orçamento calculado
+        for chave, (_, resultados) in list(self._alcance.items()):
+            if chave[0] == cidade or cidade in resultados:
+                del self._alcance[chave]
+
+    def alcancaveis(self, origem, orcamento, max_trechos):
+        # Busca do mais barato primeiro, cortando caminhos acima do orçamento. O
+        # resultado fica guardado por origem: orçamentos menores só filtram a lista
+        guardado = self._alcance.get((origem, max_trechos))
+        if guardado is None or guardado[0] < orcamento:
+            resultados = {}
+            fila = [(0, 0, (origem,))]
+            menos_trechos = {}
+            while fila:
+                custo, trechos, caminho = heapq.heappop(fila)
+                cidade = caminho[-1]
+                if menos_trechos.get(cidade, math.inf) <= trechos:
+                    continue
+                menos_trechos[cidade] = trechos
+                if cidade != origem and cidade not in resultados:
+                    resultados[cidade] = {
+                        "cidade": self.names[cidade],
+                        "valor_total": custo,
+                        "trechos": trechos,
+                        "voos": [self.adjacency[a][b][0][2] for a, b in zip(caminho, caminho[1:])],
+                    }
+                if trechos == max_trechos:
+                    continue
+                for proxima, voos in self.adjacency.get(cidade, {}).items():
+                    if proxima not in caminho and custo + voos[0][0] <= orcamento:
+                        heapq.heappush(fila, (custo + voos[0][0], trechos + 1, caminho + (proxima,)))
+            guardado = self._alcance[(origem, max_trechos)] = (orcamento, resultados)
+
+        return [resultado for resultado in guardado[1].values() if resultado["valor_total"] <= orcamento]
+
+    def k_mais_baratas(self, origem, destino, max_trechos, k=1):
+        # Algoritmo de Yen: cada nova rota desvia de uma rota já encontrada a partir
+        # de um dos seus pontos, sem repetir cidades
+        primeira = self.mais_barata(origem, destino, max_trechos)
+        if primeira is None:
+            return []
+        rotas = [primeira]
+        candidatas = []
+        vistas = {tuple(primeira[1])}
+        while len(rotas) < k:
+            caminho_anterior = rotas[-1][1]
+            for i in range(len(caminho_anterior) - 1):
+                raiz = caminho_anterior[:i + 1]
+                arestas = {
+                    (caminho[i], caminho[i + 1]) for _, caminho in rotas
+                    if len(caminho) > i + 1 and caminho[:i + 1] == raiz
+                }
+                desvio = self.mais_barata(raiz[-1], destino, max_trechos - i, arestas, set(raiz[:-1]))
+                if desvio is None:
+                    continue
+                caminho = raiz[:-1] + desvio[1]
+                if tuple(caminho) in vistas:
+                    continue
+                vistas.add(tuple(caminho))
+                custo = sum(self.peso(a, b) for a, b in zip(raiz, raiz[1:])) + desvio[0]
+                heapq.heappush(candidatas, (custo, len(caminho), caminho))
+            if not candidatas:
+                break
+            custo, _, caminho = heapq.heappop(candidatas)
+            rotas.append((custo, caminho))
+
+        return [
+            {
+                "valor_total": custo,
+                "escalas": len(caminho) - 2,
+                "voos": [self.adjacency[a][b][0][2] for a, b in zip(caminho, caminho[1:])],
+            }
+            for custo, caminho in rotas
+        ]
+
+class FareIndex:
+    # Voos de cada origem e mês de partida agrupados por destino e ordenados pelo
+    # valor_voo: a tarifa mais barata de cada destino é o primeiro da lista. Sem mês,
+    # o mesmo agrupamento já existe no RouteGraph (adjacency)
+    def __init__(self, month):
+        self.month = month
+        self.groups = {}
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def rebuild(self, records):
+        self.groups = {}
+        self._entries = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, voo):
+        edge = RouteGraph._edge(voo)
+        month = self.month(voo)
+        if edge is None or month is None:
+            return
+        entry = (voo["valor_voo"], next(self._counter), voo)
+        key = (edge[0], month)
+        self._entries[id(voo)] = (key, edge[1], entry)
+        bisect.insort(self.groups.setdefault(key, {}).setdefault(edge[1], []), entry)
+
+    def remove(self, voo):
+        key, destino, entry = self._entries.pop(id(voo), (None, None, None))
+        if key is None:
+            return
+        voos = self.groups[key][destino]
+        SortedIndex._discard(voos, entry)
+        if not voos:
+            del self.groups[key][destino]
+            if not self.groups[key]:
+                del self.groups[key]
+
+    def mais_baratos(self, origem, month, max_price=None):
+        return self.mais_baratos_por_destino(self.groups.get((origem, month), {}), max_price)
+
+    @staticmethod
+    def mais_baratos_por_destino(destinos, max_price=None):
+        # destinos: destino -> voos ordenados pelo valor_voo. Custa um passo por
+        # destino, sem percorrer os voos
+        tarifas = [voos[0] for voos in destinos.values() if max_price is None or voos[0][0] <= max_price]
+        tarifas.sort(key=lambda entry: entry[:2])
+        return [entry[2] for entry in tarifas]
+
+class ConnectionTimetable:
+    # Voos como conexões (dia da partida, origem, destino) ordenadas pela partida, para
+    # o Connection Scan Algorithm. Os voos só têm a data, então a chegada conta como
+    # o próprio dia da partida e o tempo mínimo de conexão é medido em dias
+    def __init__(self, departure):
+        self.departure = departure
+        self.connections = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def rebuild(self, records):
+        # Ordena uma vez só em vez de inserir conexão por conexão
+        self._entries = {}
+        for record in records:
+            entry = self._entry(record)
+            if entry is not None:
+                self._entries[id(record)] = entry
+        self.connections = sorted(self._entries.values())
+
+    def _entry(self, voo):
+        origem, destino, partida = voo.get("origem"), voo.get("destino"), self.departure(voo)
+        if not isinstance(origem, str) or not isinstance(destino, str) or partida in (None, date.min):
+            return None
+        origem, destino = normalizar_cidade(origem), normalizar_cidade(destino)
+        if origem == destino:
+            return None
+        return partida.toordinal(), next(self._counter), origem, destino, voo
+
+    def add(self, voo):
+        entry = self._entry(voo)
+        if entry is not None:
+            self._entries[id(voo)] = entry
+            bisect.insort(self.connections, entry)
+
+    def remove(self, voo):
+        entry = self._entries.pop(id(voo), None)
+        if entry is not None:
+            SortedIndex._discard(self.connections, entry)
+
+    def chegada_mais_cedo(self, origem, destino, inicio=None, conexao_minima=1):
+        chegada = {origem: inicio.toordinal() if inicio is not None else -math.inf}
+        anterior = {}
+
+        def embarcar(conexao):
+            partida, _, de, para, _ = conexao
+            if de not in chegada or para == origem:
+                return False
+            espera = 0 if de == origem else conexao_minima
+            if partida < chegada[de] + espera or partida >= chegada.get(para, math.inf):
+                return False
+            chegada[para] = partida
+            anterior[para] = conexao
+            return True
+
+        # Uma única passada a partir da primeira partida possível; para quando as
+        # partidas já passam da melhor chegada ao destino
+        posicao = bisect.bisect_left(self.connections, (chegada[origem],)) if inicio is not None else 0
+        while posicao < len(self.connections):
+            dia = self.connections[posicao][0]
+            if dia > chegada.get(destino, math.inf):
+                break
+            fim = bisect.bisect_left(self.connections, (dia + 1,), posicao)
+            if conexao_minima > 0:
+                for conexao in self.connections[posicao:fim]:
+                    embarcar(conexao)
+            else:
+                # Conexões no mesmo dia dependem da ordem: repete o dia até estabilizar
+                mudou = True
+                while mudou:
+                    mudou = False
+                    for conexao in self.connections[posicao:fim]:
+                        mudou = embarcar(conexao) or mudou
+            posicao = fim
+
+        if destino not in anterior:
+            return None
+        voos = []
+        cidade = destino
+        while cidade != origem:
+            conexao = anterior[cidade]
+            voos.append(conexao[4])
+            cidade = conexao[2]
+        voos.reverse()
+        return voos
+
 class BaseManagement:
-    def __init__(self, file_name):
+    collection = None
+    root_key = None
+    indexed_columns = ()
+
+    def __init__(self, file_name, use_cache=True, store=None, commit_window=0.002):
         self.file_name = file_name
+        self.use_cache = use_cache
+        self._cache = None
+        self._cache_signature = None
+        self._lock = threading.RLock()
 
-    def read_data(self):
+        # Group commit: escritas que chegam juntas são gravadas em uma única reescrita
+        self.commit_window = commit_window
+        self._commit = threading.Condition()
+        self._pending = None
+        self._pending_generation = 0
+        self._durable_generation = 0
+        self._flushing = False
+
+        self.indexes = self.create_indexes()
+        self._indexed_document = None
+        # Muda a cada escrita ou recarga do arquivo; estruturas derivadas dos dados
+        # comparam a versão para saber quando precisam ser reconstruídas
+        self.version = 0
+        self.store = store
+        if self.store is not None:
+            self.store.register(self)
+
+    def _file_signature(self):
+        # mtime/tamanho/inode identificam se o arquivo mudou desde a ultima leitura
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _load_file(self):
         try:
             with open(self.file_name, "r", encoding="utf-8") as file:
                 data = file.read()
@@ -22,13 +583,305 @@ class BaseManagement:
         except FileNotFoundError:
             return []
 
+    def _write_pending(self):
+        return self._pending_generation != self._durable_generation
+
+    def current_version(self):
+        if self.store is None:
+            # Confere se o arquivo mudou em disco (recarregar incrementa a versão)
+            self.read_data()
+        return self.version
+
+    def read_data(self):
+        if self.store is not None:
+            return self.store.read_document(self)
+
+        with self._lock:
+            # Enquanto houver escrita pendente o documento em memória é mais novo que o arquivo
+            if self._write_pending():
+                return self._pending
+
+            if not self.use_cache:
+                self.version += 1
+                return self._load_file()
+
+            signature = self._file_signature()
+            if self._cache is None or signature != self._cache_signature:
+                self._cache = self._load_file()
+                self._cache_signature = signature
+                self.version += 1
+            return self._cache
+
     def write_data(self, data):
-        with open(self.file_name, "w") as file:
-            json.dump(data, file)
+        if self.store is not None:
+            self.store.write_document(self, data)
+            self.version += 1
+            return
+
+        with self._lock:
+            # O documento pode ter sido alterado no lugar (carregar_roteiros/salvar_roteiros
+            # e afins): os índices são reconstruídos na próxima consulta
+            self._indexed_document = None
+            generation = self._stage_write(data)
+        self._wait_durable(generation)
+
+    def _stage_write(self, data):
+        with self._lock:
+            if self.use_cache:
+                self._cache = data
+            self.version += 1
+            with self._commit:
+                self._pending = data
+                self._pending_generation += 1
+                return self._pending_generation
+
+    def _wait_durable(self, generation):
+        # Group commit: retorna só quando o lote que contém esta escrita estiver em disco
+        with self._commit:
+            while self._durable_generation < generation:
+                if self._flushing:
+                    self._commit.wait()
+                else:
+                    self._flush_pending()
+
+    def _flush_pending(self):
+        # Chamado com self._commit adquirido; espera a janela para juntar outras
+        # escritas no mesmo lote e grava o documento mais recente sem segurar locks
+        self._flushing = True
+        deadline = time.monotonic() + self.commit_window
+        while (remaining := deadline - time.monotonic()) > 0:
+            self._commit.wait(remaining)
+
+        self._commit.release()
+        written_generation = None
+        try:
+            with self._lock:
+                with self._commit:
+                    data, generation = self._pending, self._pending_generation
+                content = json.dumps(data)
+            self._write_file(content)
+            with self._lock:
+                if self.use_cache and generation == self._pending_generation:
+                    self._cache_signature = self._file_signature()
+            written_generation = generation
+        finally:
+            self._commit.acquire()
+            self._flushing = False
+            if written_generation is not None:
+                self._durable_generation = written_generation
+            self._commit.notify_all()
+
+    def _write_file(self, content):
+        # Arquivo temporário + fsync + rename: uma queda nunca deixa o JSON pela metade
+        temp_file = f"{self.file_name}.tmp"
+        with open(temp_file, "w") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.file_name)
+
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.file_name)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def index_columns(self, record):
+        return {}
+
+    def create_indexes(self):
+        return {}
+
+    def validate_record(self, record):
+        pass
+
+    def _sync_indexes(self):
+        # Chamado com self._lock adquirido: reconstrói os índices quando o documento
+        # foi recarregado do disco; alterações feitas por aqui os atualizam no lugar
+        data = self.read_data()
+        if data is not self._indexed_document:
+            records = self.records_from_document(data)
+            for index in self.indexes.values():
+                index.rebuild(records)
+            self._indexed_document = data
+        return data
+
+    def records_from_document(self, data):
+        if self.root_key is None:
+            return data or []
+        if not data:
+            return []
+        return data.get(self.root_key, [])
+
+    def document_from_records(self, records):
+        if self.root_key is None:
+            return records
+        return {self.root_key: records}
+
+    def _matches(self, record, filters):
+        columns = self.index_columns(record)
+        return all(columns.get(column) == value for column, value in filters.items())
+
+    def read_records(self):
+        if self.store is not None:
+            return self.store.select(self)
+        return self.records_from_document(self.read_data())
+
+    def get_index(self, name):
+        with self._lock:
+            self._sync_indexes()
+            return self.indexes[name]
+
+    def find_records(self, order_by_desc=None, limit=None, **filters):
+        if self.store is not None:
+            return self.store.select(self, order_by_desc=order_by_desc, limit=limit, **filters)
+
+        with self._lock:
+            data = self._sync_indexes()
+            if len(filters) == 1 and next(iter(filters)) in self.indexes:
+                column, value = next(iter(filters.items()))
+                index = self.indexes[column]
+                records = list(index.lookup(value))
+                # O índice já entrega os registros na ordem pedida
+                if order_by_desc is not None and getattr(index, "order_by_desc", None) == order_by_desc:
+                    order_by_desc = None
+            else:
+                records = [record for record in self.records_from_document(data) if self._matches(record, filters)]
+
+        if order_by_desc is not None:
+            records.sort(key=lambda record: nota_numerica(self.index_columns(record).get(order_by_desc)), reverse=True)
+        if limit is not None:
+            records = records[:limit]
+        return records
+
+    def add_record(self, record):
+        if self.store is not None:
+            self.store.insert(self, record)
+            self.version += 1
+            return
+
+        self._wait_durable(self._stage_add(record))
+
+    def _update_indexes(self, removed, added):
+        # Chamado com self._lock adquirido e antes de mexer no documento: se algum
+        # índice falhar, desfaz o que já foi aplicado para tudo continuar igual
+        done = []
+        try:
+            for index in self.indexes.values():
+                for record in removed:
+                    index.remove(record)
+                    done.append((index.add, record))
+                for record in added:
+                    index.add(record)
+                    done.append((index.remove, record))
+        except BaseException:
+            for undo, record in reversed(done):
+                undo(record)
+            raise
+
+    def _stage_add(self, record):
+        with self._lock:
+            data = self._sync_indexes()
+            self.validate_record(record)
+            self._update_indexes((), (record,))
+            if self.root_key is None:
+                data.append(record)
+            else:
+                if not data:
+                    data = {}
+                data.setdefault(self.root_key, []).append(record)
+            self._indexed_document = data
+            return self._stage_write(data)
+
+    def replace_records(self, record, **filters):
+        if self.store is not None:
+            self.store.update(self, record, **filters)
+            self.version += 1
+            return
+
+        self._wait_durable(self._stage_replace(record, filters))
+
+    def _stage_replace(self, record, filters):
+        with self._lock:
+            data = self._sync_indexes()
+            self.validate_record(record)
+            existing = self.records_from_document(data)
+            matches = [self._matches(current, filters) for current in existing]
+            replaced = [current for current, match in zip(existing, matches) if match]
+            self._update_indexes(replaced, (record,) if replaced else ())
+            records = [record if match else current for current, match in zip(existing, matches)]
+            data = self.document_from_records(records)
+            self._indexed_document = data
+            return self._stage_write(data)
+
+    def upsert_record(self, record, **filters):
+        # Substitui os registros que casam com os filtros ou insere um novo; a escolha
+        # e a gravação ficam sob o lock, mas a espera pelo disco fica fora dele
+        if self.store is not None:
+            with self._lock:
+                if self.store.select(self, limit=1, **filters):
+                    self.store.update(self, record, **filters)
+                else:
+                    self.store.insert(self, record)
+                self.version += 1
+            return
+
+        with self._lock:
+            if self.find_records(limit=1, **filters):
+                generation = self._stage_replace(record, filters)
+            else:
+                generation = self._stage_add(record)
+        self._wait_durable(generation)
+
+    def delete_records(self, **filters):
+        if self.store is not None:
+            self.store.delete(self, **filters)
+            self.version += 1
+            return
+
+        with self._lock:
+            existing = self.records_from_document(self._sync_indexes())
+            matches = [self._matches(current, filters) for current in existing]
+            self._update_indexes([current for current, match in zip(existing, matches) if match], ())
+            records = [current for current, match in zip(existing, matches) if not match]
+            data = self.document_from_records(records)
+            self._indexed_document = data
+            generation = self._stage_write(data)
+        self._wait_durable(generation)
 
 class UserManagement(BaseManagement):
-    def __init__(self, users_file="usuarios.json"):
-        super().__init__(users_file)
+    collection = "usuarios"
+    indexed_columns = (("id_usuario",), ("email",))
+
+    def __init__(self, users_file="usuarios.json", store=None):
+        super().__init__(users_file, store=store)
+
+    @staticmethod
+    def normalize_email(email):
+        if not isinstance(email, str) or not email.strip():
+            return None
+        return email.strip().lower()
+
+    def user_email(self, user):
+        return self.normalize_email(user.get("dados_do_usuario", {}).get("email"))
+
+    def index_columns(self, user):
+        return {"id_usuario": user.get("id_usuario"), "email": self.user_email(user)}
+
+    def create_indexes(self):
+        return {
+            "id_usuario": UniqueIndex(lambda user: user.get("id_usuario")),
+            "email": UniqueIndex(self.user_email),
+        }
+
+    def validate_record(self, user):
+        email = self.user_email(user)
+        if email is None:
+            return
+        for existing in self.find_records(email=email):
+            if existing["id_usuario"] != user["id_usuario"]:
+                raise HTTPException(status_code=409, detail="E-mail já cadastrado para outro usuário")
 
     def generate_user_id(self):
         return str(uuid.uuid4())
@@ -40,48 +893,58 @@ class UserManagement(BaseManagement):
         self.write_data(users)
 
     def get_user_by_id(self, user_id):
-        users = self.read_users()
-        for user in users:
-            if user["id_usuario"] == user_id:
-                return user
-        return None
+        users = self.find_records(id_usuario=user_id, limit=1)
+        return users[0] if users else None
 
-    def update_user(self, user_id: str, updated_data: dict):
-        users = self.read_users()
-        user_index = None
+    def get_user_by_email(self, email):
+        email = self.normalize_email(email)
+        if email is None:
+            return None
+        users = self.find_records(email=email, limit=1)
+        return users[0] if users else None
 
-        for i, user in enumerate(users):
-            if user["id_usuario"] == user_id:
-                user_index = i
-                break
+    def insert_user(self, user):
+        self.add_record(user)
+
+    def save_user(self, user):
+        self.replace_records(user, id_usuario=user["id_usuario"])
 
-        if user_index is not None:
-            users[user_index].update(updated_data)
-            self.write_users(users)
+    def remove_user(self, user_id):
+        self.delete_records(id_usuario=user_id)
+
+    def update_user(self, user_id: str, updated_data: dict):
+        if updated_data.get("id_usuario", user_id) != user_id:
+            raise HTTPException(status_code=400, detail="O id_usuario não pode ser alterado")
+        user = self.get_user_by_id(user_id)
+
+        if user is not None:
+            user = dict(user)
+            user.update(updated_data)
+            user["id_usuario"] = user_id
+            self.save_user(user)
             return {"message": f"Informações do usuário {user_id} atualizadas com sucesso!"}
         else:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
     def delete_user(self, user_id: str):
-        users = self.read_users()
         user = self.get_user_by_id(user_id)
 
         if user:
-            users.remove(user)
-            self.write_users(users)
+            self.remove_user(user_id)
             return {"message": f"Usuário {user_id} deletado com sucesso!"}
         else:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
     def copy_itinerary(self, id_usuario_1: str, id_usuario_2: str):
-        users = self.read_users()
-
         usuario_1 = self.get_user_by_id(id_usuario_1)
         usuario_2 = self.get_user_by_id(id_usuario_2)
 
         if usuario_1 is None or usuario_2 is None:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
+        usuario_1 = dict(usuario_1)
+        usuario_1["dados_do_usuario"] = dict(usuario_1["dados_do_usuario"])
+
         # Copiar itinerário do usuário 2 para o usuário 1
         usuario_1["dados_voo"] = usuario_2["dados_voo"]
         usuario_1["dados_hotel"] = usuario_2["dados_hotel"]
@@ -95,42 +958,1166 @@ class UserManagement(BaseManagement):
         )
 
         # Salvar as alterações
-        self.write_users(users)
+        self.save_user(usuario_1)
 
         return {"message": "Itinerário copiado com sucesso"}
-    
+
+class UserLogManagement(UserManagement):
+    # Cada alteração vira uma linha no log; o estado atual é reconstruído
+    # a partir do último checkpoint mais as linhas posteriores a ele.
+    def __init__(self, log_file="usuarios.log.jsonl", users_file="usuarios.json",
+                 checkpoint_file="usuarios.checkpoint.json", fsync=False):
+        super().__init__(users_file)
+        self.log_file = log_file
+        self.checkpoint_file = checkpoint_file
+        self.fsync = fsync
+        self._users = {}
+        self._seq = 0
+        self._records_since_checkpoint = 0
+        self._compaction_lock = threading.Lock()
+        self._stop_compaction = threading.Event()
+
+        if os.path.exists(self.checkpoint_file) or os.path.exists(self.log_file):
+            self._load_checkpoint()
+            if os.path.exists(self.log_file):
+                self._replay_log()
+        else:
+            # Primeira execução: o checkpoint inicial vem do arquivo JSON atual
+            for user in self.read_data():
+                self._users[user["id_usuario"]] = user
+            for index in self.indexes.values():
+                index.rebuild(self._users.values())
+            self._write_checkpoint(list(self._users.values()), self._seq)
+
+        self._log = open(self.log_file, "ab")
+
+    def _apply(self, record):
+        previous = self._users.get(record["id_usuario"])
+        if previous is not None:
+            for index in self.indexes.values():
+                index.remove(previous)
+
+        if record["op"] == "put":
+            self._users[record["id_usuario"]] = record["usuario"]
+            for index in self.indexes.values():
+                index.add(record["usuario"])
+        elif record["op"] == "delete":
+            self._users.pop(record["id_usuario"], None)
+
+    def _sync_indexes(self):
+        # Os índices são mantidos por _apply
+        return self._users.values()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return
+        self._seq = checkpoint["seq"]
+        self._users = {user["id_usuario"]: user for user in checkpoint["usuarios"]}
+        for index in self.indexes.values():
+            index.rebuild(self._users.values())
+
+    def _replay_log(self):
+        checkpoint_seq = self._seq
+        valid_size = 0
+        with open(self.log_file, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                seq = record.get("seq", self._seq + 1)
+                # Registros já incluídos no checkpoint (queda durante a compactação)
+                if seq <= checkpoint_seq:
+                    continue
+                self._apply(record)
+                self._seq = seq
+                self._records_since_checkpoint += 1
+
+        # Descarta uma última linha incompleta (queda durante a escrita)
+        if valid_size != os.path.getsize(self.log_file):
+            with open(self.log_file, "r+b") as file:
+                file.truncate(valid_size)
+
+    def _append(self, record):
+        with self._lock:
+            record["seq"] = self._seq + 1
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            self._log.write(line.encode("utf-8"))
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self._apply(record)
+            self.version += 1
+            self._seq = record["seq"]
+            self._records_since_checkpoint += 1
+
+    def _write_checkpoint(self, users, seq):
+        temp_file = self.checkpoint_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as file:
+            json.dump({"seq": seq, "usuarios": users}, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.checkpoint_file)
+
+    def compact(self):
+        with self._compaction_lock:
+            # Os registros de usuário nunca são alterados no lugar (save_user grava
+            # um novo dicionário), então a lista capturada aqui é um snapshot estável.
+            with self._lock:
+                snapshot = list(self._users.values())
+                seq = self._seq
+                offset = self._log.tell()
+                tail_records = self._records_since_checkpoint
+
+            # A serialização do checkpoint acontece sem segurar o lock
+            self._write_checkpoint(snapshot, seq)
+
+            with self._lock:
+                temp_file = self.log_file + ".tmp"
+                with open(self.log_file, "rb") as old_log, open(temp_file, "wb") as new_log:
+                    old_log.seek(offset)
+                    new_log.write(old_log.read())
+                    new_log.flush()
+                    os.fsync(new_log.fileno())
+                self._log.close()
+                os.replace(temp_file, self.log_file)
+                self._log = open(self.log_file, "ab")
+                self._records_since_checkpoint -= tail_records
+
+    def start_compaction(self, interval=60, min_records=1000):
+        def run():
+            while not self._stop_compaction.wait(interval):
+                if self._records_since_checkpoint >= min_records:
+                    self.compact()
+
+        thread = threading.Thread(target=run, name="compactacao-usuarios", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_compaction(self):
+        self._stop_compaction.set()
+
+    def current_version(self):
+        # O estado vem do log, não de usuarios.json
+        return self.version
+
+    def read_users(self):
+        return list(self._users.values())
+
+    def read_records(self):
+        return self.read_users()
+
+    def write_users(self, users):
+        with self._lock:
+            ids = {user["id_usuario"] for user in users}
+            for user_id in [user_id for user_id in self._users if user_id not in ids]:
+                self.remove_user(user_id)
+            for user in users:
+                self.save_user(user)
+
+    def get_user_by_id(self, user_id):
+        return self._users.get(user_id)
+
+    def insert_user(self, user):
+        with self._lock:
+            self.validate_record(user)
+            self._append({"op": "put", "id_usuario": user["id_usuario"], "usuario": user})
+
+    def save_user(self, user):
+        with self._lock:
+            self.validate_record(user)
+            self._append({"op": "put", "id_usuario": user["id_usuario"], "usuario": user})
+
+    def remove_user(self, user_id):
+        self._append({"op": "delete", "id_usuario": user_id})
+
+def normalizar_cidade(nome):
+    # "  São  Paulo" e "sao paulo" viram a mesma chave
+    sem_acentos = unicodedata.normalize("NFKD", nome)
+    sem_acentos = "".join(c for c in sem_acentos if not unicodedata.combining(c))
+    return " ".join(sem_acentos.casefold().split())
+
+def nota_numerica(valor):
+    # Notas ausentes ou que não são números contam como 0 nas ordenações
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return 0
+    return valor
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+def distancias_km(latitude, longitude, latitudes, longitudes):
+    # Distância de um ponto a vários pontos de uma vez
+    if np is None:
+        return [haversine_km(latitude, longitude, lat, lon) for lat, lon in zip(latitudes, longitudes)]
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(np.asarray(latitudes, dtype=float)), np.radians(np.asarray(longitudes, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def matriz_distancias_km(latitudes, longitudes):
+    if np is None:
+        return [distancias_km(lat, lon, latitudes, longitudes) for lat, lon in zip(latitudes, longitudes)]
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+         + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+    return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+class GridIndex:
+    # Grade uniforme de células de cell_deg graus: cada ponto fica na célula da sua
+    # latitude/longitude, e as buscas só visitam as células que cruzam a área pedida
+    def __init__(self, cell_deg=1.0):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def add(self, key, latitude, longitude, item):
+        self.remove(key)
+        cell = self._cell(latitude, longitude)
+        self._points[key] = (cell, latitude, longitude, item)
+        self.cells.setdefault(cell, {})[key] = (latitude, longitude, item)
+
+    def remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = self.cells[point[0]]
+        del cell[key]
+        if not cell:
+            del self.cells[point[0]]
+
+    def get(self, key):
+        point = self._points.get(key)
+        return point[3] if point is not None else None
+
+    def locate(self, key):
+        point = self._points.get(key)
+        return point[1:3] if point is not None else None
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon):
+        lat_cells = range(self._cell(min_lat, 0)[0], self._cell(max_lat, 0)[0] + 1)
+        if min_lon <= max_lon:
+            lon_cells = list(range(self._cell(0, min_lon)[1], self._cell(0, max_lon)[1] + 1))
+        else:
+            # Caixa que cruza o antimeridiano (ex.: 170 a -170)
+            lon_cells = list(range(self._cell(0, min_lon)[1], self._cell(0, 180)[1] + 1))
+            lon_cells += range(self._cell(0, -180)[1], self._cell(0, max_lon)[1] + 1)
+
+        # Com uma área muito grande sai mais barato percorrer só as células ocupadas
+        if len(lat_cells) * len(lon_cells) > len(self.cells):
+            lon_set = set(lon_cells)
+            cells = [
+                pontos for (lat_cell, lon_cell), pontos in self.cells.items()
+                if lat_cell in lat_cells and lon_cell in lon_set
+            ]
+        else:
+            cells = [self.cells.get((lat_cell, lon_cell)) for lat_cell in lat_cells for lon_cell in lon_cells]
+
+        for pontos in cells:
+            if pontos:
+                yield from pontos.values()
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        def dentro_lon(longitude):
+            if min_lon <= max_lon:
+                return min_lon <= longitude <= max_lon
+            return longitude >= min_lon or longitude <= max_lon
+
+        return [
+            (latitude, longitude, item)
+            for latitude, longitude, item in self._candidates(min_lat, min_lon, max_lat, max_lon)
+            if min_lat <= latitude <= max_lat and dentro_lon(longitude)
+        ]
+
+    def radius(self, latitude, longitude, raio_km):
+        # Caixa que contém o círculo; a distância exata filtra os cantos
+        delta_lat = math.degrees(raio_km / 6371.0)
+        min_lat, max_lat = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+        cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+        if min_lat <= -90.0 or max_lat >= 90.0 or cos_lat <= 0 or delta_lat / cos_lat >= 180.0:
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            delta_lon = delta_lat / cos_lat
+            min_lon = (longitude - delta_lon + 180.0) % 360.0 - 180.0
+            max_lon = (longitude + delta_lon + 180.0) % 360.0 - 180.0
+
+        resultado = []
+        for lat, lon, item in self.bbox(min_lat, min_lon, max_lat, max_lon):
+            distancia = haversine_km(latitude, longitude, lat, lon)
+            if distancia <= raio_km:
+                resultado.append((distancia, lat, lon, item))
+        resultado.sort(key=lambda ponto: ponto[0])
+        return resultado
+
+class ClusterPyramid:
+    # Agrupamentos de pontos por nível de zoom (0 a max_zoom), numa grade sobre a
+    # projeção Web Mercator com células de cell_px pixels de um bloco de 256 px.
+    # Cada ponto novo só soma nas células dos seus níveis, sem reagrupar o resto
+    MAX_LATITUDE = 85.05112878
+
+    def __init__(self, max_zoom=16, cell_px=64):
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.levels = [{} for _ in range(max_zoom + 1)]
+
+    @classmethod
+    def _mercator(cls, latitude, longitude):
+        # Posição no mapa-múndi normalizada entre 0 e 1
+        latitude = min(max(latitude, -cls.MAX_LATITUDE), cls.MAX_LATITUDE)
+        seno = math.sin(math.radians(latitude))
+        x = (longitude + 180.0) / 360.0
+        y = 0.5 - math.log((1 + seno) / (1 - seno)) / (4 * math.pi)
+        return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+    def _cells_per_side(self, zoom):
+        return (256 // self.cell_px) * 2 ** zoom
+
+    def _cell(self, zoom, x, y):
+        lado = self._cells_per_side(zoom)
+        return min(int(x * lado), lado - 1), min(int(y * lado), lado - 1)
+
+    def add(self, latitude, longitude, ponto):
+        x, y = self._mercator(latitude, longitude)
+        for zoom, level in enumerate(self.levels):
+            cluster = level.get(self._cell(zoom, x, y))
+            if cluster is None:
+                level[self._cell(zoom, x, y)] = {
+                    "pontos": 1, "roteiros": ponto["roteiros"],
+                    "soma_lat": latitude, "soma_lon": longitude, "ponto": ponto,
+                }
+            else:
+                cluster["pontos"] += 1
+                cluster["roteiros"] += ponto["roteiros"]
+                cluster["soma_lat"] += latitude
+                cluster["soma_lon"] += longitude
+
+    def add_roteiros(self, latitude, longitude, quantidade=1):
+        x, y = self._mercator(latitude, longitude)
+        for zoom, level in enumerate(self.levels):
+            level[self._cell(zoom, x, y)]["roteiros"] += quantidade
+
+    def clusters(self, zoom, min_lat=-90.0, min_lon=-180.0, max_lat=90.0, max_lon=180.0):
+        zoom = min(max(zoom, 0), self.max_zoom)
+        level = self.levels[zoom]
+        x_min, y_min = self._cell(zoom, *self._mercator(max_lat, min_lon))
+        x_max, y_max = self._cell(zoom, *self._mercator(min_lat, max_lon))
+        if min_lon <= max_lon:
+            colunas = range(x_min, x_max + 1)
+        else:
+            # Área que cruza o antimeridiano
+            colunas = list(range(x_min, self._cells_per_side(zoom))) + list(range(0, x_max + 1))
+        linhas = range(y_min, y_max + 1)
+
+        if len(colunas) * len(linhas) > len(level):
+            colunas = set(colunas)
+            cells = [cluster for (x, y), cluster in level.items() if x in colunas and y in linhas]
+        else:
+            cells = [level.get((x, y)) for x in colunas for y in linhas]
+
+        resultado = []
+        for cluster in cells:
+            if cluster is None:
+                continue
+            latitude = cluster["soma_lat"] / cluster["pontos"]
+            longitude = cluster["soma_lon"] / cluster["pontos"]
+            if cluster["pontos"] == 1:
+                resultado.append({"tipo": "ponto", **cluster["ponto"], "latitude": latitude, "longitude": longitude})
+            else:
+                resultado.append({
+                    "tipo": "cluster", "pontos": cluster["pontos"], "roteiros": cluster["roteiros"],
+                    "latitude": latitude, "longitude": longitude,
+                })
+        resultado.sort(key=lambda cluster: -cluster.get("pontos", 1))
+        return resultado
+
+class Gazetteer:
+    # Geocodificador local: tabela em arrays (nome, latitude, longitude), índice por
+    # nome/alias normalizado e uma KD-tree sobre os pontos na esfera unitária
+    def __init__(self, gazetteer_file="gazetteer_cidades.json"):
+        self.gazetteer_file = gazetteer_file
+        self.nomes = []
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.indice_nomes = {}
+        self._pontos = (array("d"), array("d"), array("d"))
+        self._arvore = array("l")
+        self.carregar()
+
+    def carregar(self):
+        try:
+            with open(self.gazetteer_file, "r", encoding="utf-8") as file:
+                cidades = json.load(file)["cidades"]
+        except FileNotFoundError:
+            cidades = []
+
+        for cidade in cidades:
+            linha = len(self.nomes)
+            self.nomes.append(cidade["nome"])
+            self.latitudes.append(float(cidade["latitude"]))
+            self.longitudes.append(float(cidade["longitude"]))
+            for nome in [cidade["nome"], *cidade.get("aliases", [])]:
+                self.indice_nomes.setdefault(normalizar_cidade(nome), linha)
+            for eixo, valor in zip(self._pontos, self._ponto(self.latitudes[linha], self.longitudes[linha])):
+                eixo.append(valor)
+
+        self._arvore = array("l", range(len(self.nomes)))
+        self._construir(0, len(self._arvore), 0)
+
+    @staticmethod
+    def _ponto(latitude, longitude):
+        # Distância entre pontos na esfera cresce junto com a distância real na superfície
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+    def _construir(self, inicio, fim, profundidade):
+        # KD-tree implícita: a mediana de cada faixa fica no meio dela
+        if fim - inicio <= 1:
+            return
+        eixo = self._pontos[profundidade % 3]
+        self._arvore[inicio:fim] = array("l", sorted(self._arvore[inicio:fim], key=lambda linha: eixo[linha]))
+        meio = (inicio + fim) // 2
+        self._construir(inicio, meio, profundidade + 1)
+        self._construir(meio + 1, fim, profundidade + 1)
+
+    def buscar(self, nome):
+        linha = self.indice_nomes.get(normalizar_cidade(nome))
+        if linha is None:
+            return None
+        return self.latitudes[linha], self.longitudes[linha]
+
+    def mais_proximas(self, latitude, longitude, k=1):
+        alvo = self._ponto(latitude, longitude)
+        melhores = []  # heap de (-distância², linha) com as k mais próximas
+
+        def visitar(inicio, fim, profundidade):
+            if inicio >= fim:
+                return
+            meio = (inicio + fim) // 2
+            linha = self._arvore[meio]
+            distancia = sum((eixo[linha] - valor) ** 2 for eixo, valor in zip(self._pontos, alvo))
+            if len(melhores) < k:
+                heapq.heappush(melhores, (-distancia, linha))
+            elif distancia < -melhores[0][0]:
+                heapq.heapreplace(melhores, (-distancia, linha))
+
+            diferenca = alvo[profundidade % 3] - self._pontos[profundidade % 3][linha]
+            perto, longe = ((meio + 1, fim), (inicio, meio)) if diferenca > 0 else ((inicio, meio), (meio + 1, fim))
+            visitar(*perto, profundidade + 1)
+            if len(melhores) < k or diferenca ** 2 < -melhores[0][0]:
+                visitar(*longe, profundidade + 1)
+
+        visitar(0, len(self._arvore), 0)
+        return [
+            {
+                "cidade": self.nomes[linha],
+                "latitude": self.latitudes[linha],
+                "longitude": self.longitudes[linha],
+                "distancia_km": haversine_km(latitude, longitude, self.latitudes[linha], self.longitudes[linha]),
+            }
+            for _, linha in sorted(melhores, reverse=True)
+        ]
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+class SingleFlight:
+    # Chamadas simultâneas com a mesma chave compartilham uma única execução e o seu resultado
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class OutboundScheduler:
+    # Limita as chamadas a um serviço externo com um token bucket. Quem não tem token
+    # espera numa fila limitada, atendida por prioridade e depois por ordem de chegada.
+    INTERATIVA = 0
+    PREFETCH = 1
+
+    def __init__(self, rate=1.0, burst=1, max_queue=1000, max_wait=10):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._metrics = {"atendidas": 0, "rejeitadas": 0, "expiradas": 0, "fila_maxima": 0,
+                         "espera_total_s": 0.0, "espera_maxima_s": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, prioridade=INTERATIVA):
+        inicio = time.monotonic()
+        deadline = inicio + self.max_wait
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._metrics["rejeitadas"] += 1
+                raise HTTPException(status_code=503, detail="Fila de consultas ao geocodificador cheia")
+
+            ticket = (prioridade, next(self._counter))
+            heapq.heappush(self._queue, ticket)
+            self._metrics["fila_maxima"] = max(self._metrics["fila_maxima"], len(self._queue))
+
+            while True:
+                self._refill()
+                if self._queue[0] == ticket and self._tokens >= 1:
+                    self._tokens -= 1
+                    heapq.heappop(self._queue)
+                    break
+
+                agora = time.monotonic()
+                if agora >= deadline:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._metrics["expiradas"] += 1
+                    self._cond.notify_all()
+                    raise HTTPException(status_code=503, detail="Tempo esgotado na fila do geocodificador")
+
+                # O primeiro da fila dorme até o próximo token; os demais até serem avisados
+                espera = deadline - agora
+                if self._queue[0] == ticket:
+                    espera = min(espera, (1 - self._tokens) / self.rate)
+                self._cond.wait(espera)
+
+            espera = time.monotonic() - inicio
+            self._metrics["atendidas"] += 1
+            self._metrics["espera_total_s"] += espera
+            self._metrics["espera_maxima_s"] = max(self._metrics["espera_maxima_s"], espera)
+            self._cond.notify_all()
+
+    def try_acquire(self):
+        # Só pega um token se ele estiver livre agora e ninguém estiver esperando
+        with self._cond:
+            self._refill()
+            if self._queue or self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self._metrics["atendidas"] += 1
+            return True
+
+    def metricas(self):
+        with self._cond:
+            self._refill()
+            metricas = dict(self._metrics)
+            metricas["fila_atual"] = len(self._queue)
+            metricas["tokens_disponiveis"] = self._tokens
+            metricas["espera_media_s"] = metricas["espera_total_s"] / metricas["atendidas"] if metricas["atendidas"] else 0.0
+            return metricas
+
+class CircuitBreaker:
+    # Depois de failure_threshold falhas seguidas o circuito abre e as chamadas falham
+    # na hora; passado reset_timeout, uma única chamada de teste decide se ele fecha
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+
+    def allow(self):
+        with self._lock:
+            if self._estado == self.FECHADO:
+                return True
+            if self._estado == self.ABERTO and time.monotonic() - self._aberto_em >= self.reset_timeout:
+                self._estado = self.MEIO_ABERTO
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._estado = self.FECHADO
+            self._falhas = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._falhas += 1
+            if self._estado == self.MEIO_ABERTO or self._falhas >= self.failure_threshold:
+                self._estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+    def cancel(self):
+        # A chamada de teste não chegou a ser feita: libera outra tentativa
+        with self._lock:
+            if self._estado == self.MEIO_ABERTO:
+                self._estado = self.ABERTO
+                self._aberto_em = time.monotonic() - self.reset_timeout
+
+    def estado(self):
+        with self._lock:
+            return {"estado": self._estado, "falhas_seguidas": self._falhas}
+
+class CoordinateCache(BaseManagement):
+    # Cache em dois níveis das coordenadas: LRU em memória e arquivo JSON em disco.
+    # Cidades não encontradas também são guardadas, com validade menor.
+    root_key = "coordenadas"
+
+    def __init__(self, cache_file="cache_coordenadas.json", ttl=30 * 24 * 3600,
+                 negative_ttl=24 * 3600, memory_size=1024):
+        super().__init__(cache_file)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(memory_size)
+
+    def index_columns(self, entrada):
+        return {"cidade": entrada.get("cidade")}
+
+    def create_indexes(self):
+        return {"cidade": UniqueIndex(lambda entrada: entrada.get("cidade"))}
+
+    def expirada(self, entrada):
+        ttl = self.ttl if entrada["encontrada"] else self.negative_ttl
+        return time.time() - entrada["atualizado_em"] > ttl
+
+    def get(self, chave, permitir_expirada=False):
+        entrada = self.memory.get(chave)
+        if entrada is None:
+            entradas = self.find_records(cidade=chave)
+            if not entradas:
+                return None
+            entrada = entradas[0]
+            self.memory.put(chave, entrada)
+        if self.expirada(entrada) and not permitir_expirada:
+            return None
+        return entrada
+
+    def put(self, chave, coordenadas):
+        entrada = {
+            "cidade": chave,
+            "encontrada": coordenadas is not None,
+            "latitude": coordenadas[0] if coordenadas else None,
+            "longitude": coordenadas[1] if coordenadas else None,
+            "atualizado_em": time.time(),
+        }
+        self.memory.put(chave, entrada)
+        self.upsert_record(entrada, cidade=chave)
+        return entrada
+
 class CityInformation(BaseManagement):
-    def __init__(self, city_file="informacoes_destinos.json"):
-        super().__init__(city_file)
+    collection = "destinos"
+    root_key = "destinos"
+    indexed_columns = (("nome_da_cidade",),)
+
+    def __init__(self, city_file="informacoes_destinos.json", store=None, coordinate_cache=None, gazetteer=None,
+                 timeout=5, scheduler=None, endpoint="https://nominatim.openstreetmap.org/search",
+                 breaker=None, hedge_after=None):
+        super().__init__(city_file, store=store)
+        self.coordinate_cache = coordinate_cache if coordinate_cache is not None else CoordinateCache()
+        self.gazetteer = gazetteer if gazetteer is not None else Gazetteer()
+        self.lookups = SingleFlight()
+        # A política de uso do Nominatim permite no máximo uma requisição por segundo
+        self.scheduler = scheduler if scheduler is not None else OutboundScheduler(rate=1.0, burst=1)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        # Se a resposta demorar mais que hedge_after segundos, uma segunda requisição é disparada
+        self.hedge_after = hedge_after
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="geocodificacao")
+        # Buscas de lote esperam o limitador aqui, fora do threadpool compartilhado do FastAPI
+        self._batch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geocodificacao-lote")
+        self.endpoint = endpoint
+
+        # Um único cliente HTTP com pool de conexões keep-alive para o Nominatim
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.http.headers["User-Agent"] = "TravelItineraryPlanner/1.0"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def index_columns(self, destino):
+        return {"nome_da_cidade": destino.get("cidade")}
 
     def obter_informacoes_cidade(self, nome_cidade):
         try:
-            destinos = self.read_data()
-            cidade_info = next((destino for destino in destinos["destinos"] if destino["cidade"] == nome_cidade), None)
+            destinos = self.find_records(nome_da_cidade=nome_cidade, limit=1)
+            cidade_info = destinos[0] if destinos else None
             if cidade_info is None:
                 raise ValueError(f"Informações não encontradas para a cidade '{nome_cidade}'")
             return {'informacoes_cidade': cidade_info}
         except FileNotFoundError:
             raise ValueError("Arquivo de dados não encontrado")
 
-    def get_coordinates(self, cidade):
-        endpoint = "https://nominatim.openstreetmap.org/search"
+    def get_coordinates(self, cidade, prioridade=OutboundScheduler.INTERATIVA):
+        coordenadas = self.coordenadas_em_cache(cidade)
+        if coordenadas is not None:
+            return coordenadas
+
+        # Buscas simultâneas pela mesma cidade fazem uma única chamada ao Nominatim
+        chave = normalizar_cidade(cidade)
+        entrada = self.lookups.do(chave, lambda: self._resolver_coordenadas(cidade, chave, prioridade))
+        return self._coordenadas_da_entrada(cidade, entrada)
+
+    def coordenadas_em_cache(self, cidade):
+        # Primeiro o gazetteer local, depois o cache; None quando só o Nominatim resolve
+        coordenadas = self.gazetteer.buscar(cidade)
+        if coordenadas is not None:
+            return coordenadas
+        entrada = self.coordinate_cache.get(normalizar_cidade(cidade))
+        if entrada is None:
+            return None
+        return self._coordenadas_da_entrada(cidade, entrada)
+
+    @staticmethod
+    def _coordenadas_da_entrada(cidade, entrada):
+        if entrada["encontrada"]:
+            return entrada["latitude"], entrada["longitude"]
+        else:
+            raise ValueError(f"Coordenadas não encontradas para a cidade: {cidade}")
+
+    def coordenadas_conhecidas(self, cidade):
+        if self.gazetteer.buscar(cidade) is not None:
+            return True
+        return self.coordinate_cache.get(normalizar_cidade(cidade)) is not None
+
+    def coordenadas_locais(self, cidade):
+        # Coordenadas já disponíveis sem chamar o Nominatim (gazetteer ou cache)
+        coordenadas = self.gazetteer.buscar(cidade)
+        if coordenadas is not None:
+            return coordenadas
+        entrada = self.coordinate_cache.get(normalizar_cidade(cidade), permitir_expirada=True)
+        if entrada is None or not entrada["encontrada"]:
+            return None
+        return entrada["latitude"], entrada["longitude"]
+
+    def _resolver_coordenadas(self, cidade, chave, prioridade):
+        entrada = self.coordinate_cache.get(chave)
+        if entrada is not None:
+            return entrada
+
+        # Com o Nominatim fora do ar, responde na hora com o que houver no cache, mesmo vencido
+        if not self.breaker.allow():
+            return self._coordenadas_antigas(chave)
+
+        try:
+            self.scheduler.acquire(prioridade)
+        except BaseException:
+            self.breaker.cancel()
+            raise
+
+        # Qualquer erro precisa passar pelo circuito, senão a chamada de teste do
+        # estado meio aberto nunca termina e ele não volta a deixar chamadas passarem
+        try:
+            coordenadas = self._buscar_com_hedge(cidade)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            return self._coordenadas_antigas(chave)
+        except BaseException:
+            # Resposta fora do formato esperado (ex.: {"error": ...}) também é falha
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        return self.coordinate_cache.put(chave, coordenadas)
+
+    def _coordenadas_antigas(self, chave):
+        entrada = self.coordinate_cache.get(chave, permitir_expirada=True)
+        if entrada is None:
+            raise HTTPException(status_code=503, detail="Serviço de geocodificação indisponível")
+        return entrada
+
+    def _buscar_com_hedge(self, cidade):
+        if self.hedge_after is None:
+            return self.buscar_coordenadas_remotas(cidade)
+
+        pendentes = {self._hedge_pool.submit(self.buscar_coordenadas_remotas, cidade)}
+        concluidas, _ = wait(pendentes, timeout=self.hedge_after)
+        # A requisição extra também respeita o limite de uso do Nominatim
+        if not concluidas and self.scheduler.try_acquire():
+            pendentes.add(self._hedge_pool.submit(self.buscar_coordenadas_remotas, cidade))
+
+        erro = None
+        while pendentes:
+            concluidas, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in concluidas:
+                if futuro.exception() is None:
+                    return futuro.result()
+                erro = futuro.exception()
+        raise erro
+
+    async def get_coordinates_async(self, cidade):
+        coordenadas = self.gazetteer.buscar(cidade)
+        if coordenadas is not None:
+            return coordenadas
+        # A consulta bloqueante roda no threadpool para não travar o event loop
+        return await asyncio.wait_for(
+            run_in_threadpool(self.get_coordinates, cidade),
+            timeout=self.timeout + (self.hedge_after or 0) + self.scheduler.max_wait,
+        )
+
+    async def get_coordinates_batch_async(self, cidade):
+        # Igual a get_coordinates_async, mas a espera roda no pool próprio dos lotes
+        return await asyncio.wait_for(
+            asyncio.wrap_future(self._batch_pool.submit(self.get_coordinates, cidade)),
+            timeout=self.timeout + (self.hedge_after or 0) + self.scheduler.max_wait,
+        )
+
+    def buscar_coordenadas_remotas(self, cidade):
         params = {
             'format': 'json',
             'q': cidade,
         }
-        response = requests.get(endpoint, params=params)
+        response = self.http.get(self.endpoint, params=params, timeout=self.timeout)
+        response.raise_for_status()
         data = response.json()
         if data:
             latitude = float(data[0]['lat'])
             longitude = float(data[0]['lon'])
             return latitude, longitude
-        else:
-            raise ValueError(f"Coordenadas não encontradas para a cidade: {cidade}")
+        return None
         
+class CoordinatePrefetcher:
+    # Resolve em segundo plano as coordenadas das cidades conhecidas, com prioridade
+    # baixa no limitador do Nominatim, para que os mapas encontrem o cache já aquecido
+    def __init__(self, city_manager, sources, retry_interval=60):
+        self.city_manager = city_manager
+        self.sources = sources
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._varredura_completa = False
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._status = {"resolvidas": 0, "nao_encontradas": 0, "falhas": 0}
+
+    def start(self):
+        self.agendar()
+        self._thread = threading.Thread(target=self._executar, name="prefetch-coordenadas", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def agendar(self, cidades=None):
+        # Sem lista de cidades, a próxima passada varre todas as fontes
+        with self._lock:
+            if cidades is None:
+                self._varredura_completa = True
+            else:
+                for cidade in cidades:
+                    if isinstance(cidade, str) and cidade.strip():
+                        self._pendentes.setdefault(normalizar_cidade(cidade), cidade)
+        self._acordar.set()
+
+    def _executar(self):
+        falhas = {}
+        while not self._parar.is_set():
+            self._acordar.wait(self.retry_interval if falhas else None)
+            self._acordar.clear()
+
+            with self._lock:
+                cidades, self._pendentes = {**falhas, **self._pendentes}, {}
+                varredura_completa, self._varredura_completa = self._varredura_completa, False
+            if varredura_completa:
+                for source in self.sources:
+                    for cidade in source():
+                        if isinstance(cidade, str) and cidade.strip():
+                            cidades.setdefault(normalizar_cidade(cidade), cidade)
+
+            falhas = {}
+            for chave, cidade in cidades.items():
+                if self._parar.is_set():
+                    break
+                if self.city_manager.coordenadas_conhecidas(cidade):
+                    continue
+                try:
+                    self.city_manager.get_coordinates(cidade, OutboundScheduler.PREFETCH)
+                    self._status["resolvidas"] += 1
+                except ValueError:
+                    self._status["nao_encontradas"] += 1
+                except Exception:
+                    # Fila cheia, circuito aberto ou erro de rede: tenta de novo mais tarde
+                    self._status["falhas"] += 1
+                    falhas[chave] = cidade
+
+    def status(self):
+        with self._lock:
+            return {**self._status, "pendentes": len(self._pendentes)}
+
+class DestinationTable:
+    # Coordenadas dos destinos de informacoes_destinos.json em arrays (NumPy quando
+    # disponível) para responder "destinos perto de X" sem laço em Python por cidade
+    def __init__(self, city_manager, prefetcher=None):
+        self.city_manager = city_manager
+        self.prefetcher = prefetcher
+        self._lock = threading.Lock()
+        self._versao = None
+        self._destinos = []
+        self._latitudes = []
+        self._longitudes = []
+        self._linhas_por_nome = {}
+        self._sem_coordenadas = []
+
+    def _sincronizar(self):
+        versao = self.city_manager.current_version()
+        with self._lock:
+            if versao != self._versao:
+                self._destinos, latitudes, longitudes, self._sem_coordenadas = [], [], [], []
+                self._linhas_por_nome = {}
+                pendentes = self.city_manager.read_records()
+            else:
+                # Só tenta de novo os destinos que ainda não tinham coordenadas
+                latitudes, longitudes = list(self._latitudes), list(self._longitudes)
+                pendentes, self._sem_coordenadas = self._sem_coordenadas, []
+
+            if versao == self._versao and not pendentes:
+                return
+
+            for destino in pendentes:
+                coordenadas = self.city_manager.coordenadas_locais(destino.get("cidade", ""))
+                if coordenadas is None:
+                    self._sem_coordenadas.append(destino)
+                    continue
+                self._linhas_por_nome.setdefault(normalizar_cidade(destino.get("cidade", "")), []).append(len(self._destinos))
+                self._destinos.append(destino)
+                latitudes.append(coordenadas[0])
+                longitudes.append(coordenadas[1])
+
+            if np is not None:
+                latitudes, longitudes = np.array(latitudes, dtype=float), np.array(longitudes, dtype=float)
+            self._latitudes, self._longitudes = latitudes, longitudes
+            self._versao = versao
+
+        if self._sem_coordenadas and self.prefetcher is not None:
+            self.prefetcher.agendar([destino.get("cidade") for destino in self._sem_coordenadas])
+
+    def proximos(self, latitude, longitude, raio_km=None, limite=10, excluir=None):
+        self._sincronizar()
+        with self._lock:
+            destinos, latitudes, longitudes = self._destinos, self._latitudes, self._longitudes
+            excluidas = self._linhas_por_nome.get(excluir, []) if excluir is not None else []
+        if not destinos:
+            return []
+
+        distancias = distancias_km(latitude, longitude, latitudes, longitudes)
+        if np is not None:
+            # A cidade excluída sai pela linha, sem percorrer os nomes
+            mascara = np.ones(len(destinos), dtype=bool)
+            mascara[excluidas] = False
+            if raio_km is not None:
+                mascara &= distancias <= raio_km
+            candidatos = np.flatnonzero(mascara)
+            # argpartition separa os mais próximos sem ordenar a tabela inteira
+            if limite is not None and len(candidatos) > limite:
+                candidatos = candidatos[np.argpartition(distancias[candidatos], limite - 1)[:limite]]
+            ordem = candidatos[np.argsort(distancias[candidatos], kind="stable")]
+        else:
+            excluidas = set(excluidas)
+            ordem = [
+                i for i in sorted(range(len(destinos)), key=distancias.__getitem__)
+                if (raio_km is None or distancias[i] <= raio_km) and i not in excluidas
+            ][:limite]
+
+        return [
+            {
+                "cidade": destinos[i].get("cidade"),
+                "pais": destinos[i].get("pais"),
+                "latitude": float(latitudes[i]),
+                "longitude": float(longitudes[i]),
+                "distancia_km": float(distancias[i]),
+            }
+            for i in ordem
+        ]
+
+class MapIndex:
+    # Índice espacial (GridIndex) das cidades de informacoes_destinos.json e roteiros.json
+    # com coordenadas já conhecidas. Novos roteiros entram por adicionar_roteiro; uma
+    # mudança feita por fora (outro processo, arquivo editado) reconstrói tudo
+    def __init__(self, city_manager, itinerary_manager, prefetcher=None, cell_deg=1.0):
+        self.city_manager = city_manager
+        self.itinerary_manager = itinerary_manager
+        self.prefetcher = prefetcher
+        self.grid = GridIndex(cell_deg)
+        self.pyramid = ClusterPyramid()
+        self._lock = threading.Lock()
+        self._versoes = None
+        self._pontos = {}
+        self._sem_coordenadas = {}
+
+    @staticmethod
+    def _cidade_do_roteiro(roteiro):
+        return roteiro.get("dados_roteiro", {}).get("nome_da_cidade")
+
+    def _ponto(self, cidade):
+        chave = normalizar_cidade(cidade)
+        ponto = self._pontos.get(chave)
+        if ponto is None:
+            ponto = self._pontos[chave] = {"cidade": cidade, "pais": None, "destino": False, "roteiros": 0}
+        return chave, ponto
+
+    def _posicionar(self, chave, ponto):
+        # Chamado com self._lock adquirido
+        if self.grid.get(chave) is not None:
+            return
+        coordenadas = self.city_manager.coordenadas_locais(ponto["cidade"])
+        if coordenadas is None:
+            self._sem_coordenadas[chave] = ponto
+        else:
+            self._sem_coordenadas.pop(chave, None)
+            self.grid.add(chave, coordenadas[0], coordenadas[1], ponto)
+            self.pyramid.add(coordenadas[0], coordenadas[1], ponto)
+
+    def _sincronizar(self):
+        versoes = (self.city_manager.current_version(), self.itinerary_manager.current_version())
+        if versoes != self._versoes:
+            destinos = self.city_manager.read_records()
+            roteiros = self.itinerary_manager.read_records()
+            with self._lock:
+                self.grid = GridIndex(self.grid.cell_deg)
+                self.pyramid = ClusterPyramid(self.pyramid.max_zoom, self.pyramid.cell_px)
+                self._pontos, self._sem_coordenadas = {}, {}
+                for destino in destinos:
+                    if isinstance(destino.get("cidade"), str) and destino["cidade"].strip():
+                        _, ponto = self._ponto(destino["cidade"])
+                        ponto["destino"] = True
+                        ponto["pais"] = destino.get("pais")
+                for roteiro in roteiros:
+                    cidade = self._cidade_do_roteiro(roteiro)
+                    if isinstance(cidade, str) and cidade.strip():
+                        self._ponto(cidade)[1]["roteiros"] += 1
+                for chave, ponto in self._pontos.items():
+                    self._posicionar(chave, ponto)
+                self._versoes = versoes
+        else:
+            # As coordenadas podem ter chegado ao cache pelo prefetch desde a última busca
+            with self._lock:
+                for chave, ponto in list(self._sem_coordenadas.items()):
+                    self._posicionar(chave, ponto)
+
+        if self._sem_coordenadas and self.prefetcher is not None:
+            self.prefetcher.agendar([ponto["cidade"] for ponto in list(self._sem_coordenadas.values())])
+
+    def adicionar_roteiro(self, roteiro):
+        # Chamado depois de gravar o roteiro: se a única mudança desde a última
+        # sincronização foi essa gravação, basta atualizar a cidade do roteiro
+        cidade = self._cidade_do_roteiro(roteiro)
+        with self._lock:
+            if self._versoes is None:
+                return
+            versoes = (self.city_manager.version, self.itinerary_manager.version)
+            if versoes != (self._versoes[0], self._versoes[1] + 1):
+                return
+            if isinstance(cidade, str) and cidade.strip():
+                chave, ponto = self._ponto(cidade)
+                ponto["roteiros"] += 1
+                posicao = self.grid.locate(chave)
+                if posicao is not None:
+                    self.pyramid.add_roteiros(*posicao)
+                else:
+                    self._posicionar(chave, ponto)
+            self._versoes = versoes
+
+    @staticmethod
+    def _resultado(latitude, longitude, ponto, distancia=None):
+        resultado = {**ponto, "latitude": latitude, "longitude": longitude}
+        if distancia is not None:
+            resultado["distancia_km"] = distancia
+        return resultado
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, limite=100):
+        self._sincronizar()
+        with self._lock:
+            pontos = self.grid.bbox(min_lat, min_lon, max_lat, max_lon)
+            pontos = [self._resultado(lat, lon, ponto) for lat, lon, ponto in pontos]
+        # Mais roteiros primeiro, para que o limite corte as cidades menos relevantes
+        pontos.sort(key=lambda ponto: (-ponto["roteiros"], not ponto["destino"], normalizar_cidade(ponto["cidade"])))
+        return {"total": len(pontos), "pontos": pontos[:limite]}
+
+    def raio(self, latitude, longitude, raio_km, limite=100):
+        self._sincronizar()
+        with self._lock:
+            pontos = self.grid.radius(latitude, longitude, raio_km)
+            pontos = [self._resultado(lat, lon, ponto, distancia) for distancia, lat, lon, ponto in pontos]
+        return {"total": len(pontos), "pontos": pontos[:limite]}
+
+    def clusters(self, zoom, min_lat=-90.0, min_lon=-180.0, max_lat=90.0, max_lon=180.0):
+        self._sincronizar()
+        with self._lock:
+            return self.pyramid.clusters(zoom, min_lat, min_lon, max_lat, max_lon)
+
 class ItineraryManagement(BaseManagement):
-    def __init__(self, itinerary_file="roteiros.json"):
-        super().__init__(itinerary_file)
+    collection = "roteiros"
+    root_key = "roteiros"
+    indexed_columns = (("nome_da_cidade", "nota"), ("nota",))
+
+    def __init__(self, itinerary_file="roteiros.json", store=None):
+        super().__init__(itinerary_file, store=store)
+
+    def index_columns(self, roteiro):
+        dados_roteiro = roteiro.get("dados_roteiro", {})
+        return {"nome_da_cidade": dados_roteiro.get("nome_da_cidade"), "nota": dados_roteiro.get("nota")}
+
+    def create_indexes(self):
+        return {
+            "nome_da_cidade": RankedIndex(
+                lambda roteiro: roteiro.get("dados_roteiro", {}).get("nome_da_cidade"),
+                lambda roteiro: nota_numerica(roteiro.get("dados_roteiro", {}).get("nota")),
+                order_by_desc="nota",
+            )
+        }
 
     def carregar_roteiros(self):
         try:
@@ -141,27 +2128,70 @@ class ItineraryManagement(BaseManagement):
     def salvar_roteiros(self, roteiros):
         self.write_data(roteiros)
 
+    def adicionar_roteiro(self, roteiro):
+        self.add_record(roteiro)
+
+    def roteiros_da_cidade(self, nome_da_cidade):
+        # Já vêm ordenados da maior para a menor nota
+        return self.find_records(order_by_desc="nota", nome_da_cidade=nome_da_cidade)
+
+    def roteiro_maior_nota(self):
+        if self.store is not None:
+            roteiros = self.find_records(order_by_desc="nota", limit=1)
+            return roteiros[0] if roteiros else None
+        return self.get_index("nome_da_cidade").best()
+
     def personalized_recommendations(self, user_id: str):
-        users = UserManagement().read_data()
-        user = UserManagement().get_user_by_id(user_id)
+        user = user_manager.get_user_by_id(user_id)
         
         if user is None:
             raise ValueError("Usuário não encontrado")
         
         cidade_origem_usuario = user["dados_voo"]["origem"]
-        roteiros = self.carregar_roteiros()["roteiros"]
         
-        roteiros_na_mesma_cidade = [r for r in roteiros if r["dados_roteiro"]["nome_da_cidade"] == cidade_origem_usuario]
+        roteiros_na_mesma_cidade = self.roteiros_da_cidade(cidade_origem_usuario)
         
         if roteiros_na_mesma_cidade:
             return {"recomendacoes": roteiros_na_mesma_cidade}
         else:
-            roteiro_maior_nota = max(roteiros, key=lambda x: x["dados_roteiro"]["nota"])
+            roteiro_maior_nota = self.roteiro_maior_nota()
             return {"recomendacoes": [roteiro_maior_nota]}
         
 class FlightManagement(BaseManagement):
-    def __init__(self, flights_file="dados_voo.json"):
-        super().__init__(flights_file)
+    collection = "voos"
+    root_key = "dados_voo"
+    indexed_columns = (("origem", "destino"),)
+
+    def __init__(self, flights_file="dados_voo.json", store=None):
+        super().__init__(flights_file, store=store)
+        self._indices_store = {}
+
+    def index_columns(self, voo):
+        return {"origem": voo.get("origem"), "destino": voo.get("destino")}
+
+    @staticmethod
+    def parse_data(texto):
+        return datetime.strptime(texto, "%d/%m/%Y").date()
+
+    def data_da_partida(self, voo):
+        # Voos sem data válida ficam no começo da ordenação
+        try:
+            return self.parse_data(voo.get("data_da_partida", ""))
+        except (TypeError, ValueError):
+            return date.min
+
+    def mes_da_partida(self, voo):
+        partida = self.data_da_partida(voo)
+        return None if partida == date.min else (partida.year, partida.month)
+
+    def create_indexes(self):
+        return {
+            "origem": SortedIndex(lambda voo: voo.get("origem"), self.data_da_partida),
+            "rota": SortedIndex(lambda voo: (voo.get("origem"), voo.get("destino")), self.data_da_partida),
+            "grafo": RouteGraph(),
+            "conexoes": ConnectionTimetable(self.data_da_partida),
+            "tarifas": FareIndex(self.mes_da_partida),
+        }
 
     def carregar_data(self):
         try:
@@ -172,37 +2202,262 @@ class FlightManagement(BaseManagement):
     def salvar_data(self, dados_voo):
         self.write_data(dados_voo)
 
+    def adicionar_voo(self, voo):
+        self.add_record(voo)
+
+    def buscar_voos(self, origem, destino=None, data_inicio=None, data_fim=None):
+        if self.store is not None:
+            filtros = {"origem": origem}
+            if destino is not None:
+                filtros["destino"] = destino
+            return [
+                voo for voo in self.find_records(**filtros)
+                if (data_inicio is None or self.data_da_partida(voo) >= data_inicio)
+                and (data_fim is None or self.data_da_partida(voo) <= data_fim)
+            ]
+
+        # Voos ordenados por data em cada origem/rota: o intervalo sai por busca binária
+        if destino is None:
+            return self.get_index("origem").range(origem, data_inicio, data_fim)
+        return self.get_index("rota").range((origem, destino), data_inicio, data_fim)
+
+    def _consultar_indice(self, nome, consulta):
+        # Sem store os índices são mantidos a cada voo gravado; com o SQLite eles são
+        # montados de novo só quando a coleção muda
+        if self.store is None:
+            with self._lock:
+                self._sync_indexes()
+                return consulta(self.indexes[nome])
 
+        with self._lock:
+            versao, indice = self._indices_store.get(nome, (None, None))
+            if versao != self.version:
+                versao, indice = self.version, None
+        if indice is None:
+            indice = self.create_indexes()[nome]
+            indice.rebuild(self.read_records())
+            with self._lock:
+                if self.version == versao:
+                    self._indices_store[nome] = (versao, indice)
+        return consulta(indice)
 
-flight_manager = FlightManagement()
-itinerary_manager = ItineraryManagement()
-user_manager = UserManagement()
-city_manager = CityInformation()
+    def rotas_mais_baratas(self, origem, destino, max_trechos=3, k=1):
+        origem, destino = normalizar_cidade(origem), normalizar_cidade(destino)
+        return self._consultar_indice("grafo", lambda grafo: grafo.k_mais_baratas(origem, destino, max_trechos, k))
+
+    def voos_mais_baratos(self, origem):
+        # Voo direto mais barato de origem para cada destino, pelo grafo de rotas
+        origem = normalizar_cidade(origem)
+        return self._consultar_indice(
+            "grafo", lambda grafo: {destino: voos[0][2] for destino, voos in grafo.adjacency.get(origem, {}).items()}
+        )
+
+    def destinos_mais_baratos(self, origem, mes=None, preco_maximo=None):
+        origem = normalizar_cidade(origem)
+        if mes is None:
+            return self._consultar_indice(
+                "grafo", lambda grafo: FareIndex.mais_baratos_por_destino(grafo.adjacency.get(origem, {}), preco_maximo)
+            )
+        return self._consultar_indice("tarifas", lambda tarifas: tarifas.mais_baratos(origem, mes, preco_maximo))
+
+    def destinos_alcancaveis(self, origem, orcamento, max_trechos=3):
+        origem = normalizar_cidade(origem)
+        return self._consultar_indice("grafo", lambda grafo: grafo.alcancaveis(origem, orcamento, max_trechos))
+
+    def viagem_mais_rapida(self, origem, destino, data_inicio=None, min_conexao_dias=1):
+        origem, destino = normalizar_cidade(origem), normalizar_cidade(destino)
+        return self._consultar_indice(
+            "conexoes",
+            lambda conexoes: conexoes.chegada_mais_cedo(origem, destino, data_inicio, min_conexao_dias),
+        )
+
+
+class BundleOptimizer:
+    # Escolhe voo + hotel + roteiro com a maior nota (hotel + roteiro) dentro do
+    # orçamento. Hotéis (dados_hotel dos usuários) e roteiros ficam por cidade em
+    # listas ordenadas pelo preço; nos roteiros, o máximo acumulado da nota diz o
+    # melhor roteiro até qualquer preço com uma busca binária
+    def __init__(self, flight_manager, itinerary_manager, user_manager):
+        self.flight_manager = flight_manager
+        self.itinerary_manager = itinerary_manager
+        self.user_manager = user_manager
+        self._lock = threading.Lock()
+        self._versoes = None
+        self._cidades = {}
+
+    @staticmethod
+    def _numero(valor, padrao=None):
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            return padrao
+        return valor
+
+    def _catalogo(self):
+        versoes = (self.user_manager.current_version(), self.itinerary_manager.current_version())
+        with self._lock:
+            if versoes == self._versoes:
+                return self._cidades
+
+        hoteis = {}
+        for usuario in self.user_manager.read_records():
+            hotel = usuario.get("dados_hotel") or {}
+            preco, cidade = self._numero(hotel.get("valor_hotel")), hotel.get("nome_da_cidade")
+            if preco is None or preco < 0 or not isinstance(cidade, str):
+                continue
+            # O mesmo hotel aparece em vários usuários
+            chave = (hotel.get("id_hotel") or hotel.get("hotel"), preco)
+            hoteis.setdefault(normalizar_cidade(cidade), {}).setdefault(chave, hotel)
+
+        roteiros = {}
+        for roteiro in self.itinerary_manager.read_records():
+            dados = roteiro.get("dados_roteiro", {})
+            # Roteiros do catálogo sem valor_roteiro entram como gratuitos
+            preco, cidade = self._numero(dados.get("valor_roteiro"), 0), dados.get("nome_da_cidade")
+            if preco < 0 or not isinstance(cidade, str):
+                continue
+            roteiros.setdefault(normalizar_cidade(cidade), []).append(roteiro)
+
+        cidades = {}
+        for cidade in hoteis.keys() & roteiros.keys():
+            lista_hoteis = sorted(
+                ((hotel["valor_hotel"], self._numero(hotel.get("nota"), 0), hotel) for hotel in hoteis[cidade].values()),
+                key=lambda item: (item[0], -item[1]),
+            )
+            lista_roteiros = sorted(
+                (
+                    (self._numero(roteiro["dados_roteiro"].get("valor_roteiro"), 0),
+                     self._numero(roteiro["dados_roteiro"].get("nota"), 0), roteiro)
+                    for roteiro in roteiros[cidade]
+                ),
+                key=lambda item: (item[0], -item[1]),
+            )
+            melhores = []
+            for posicao, (_, nota, _) in enumerate(lista_roteiros):
+                if not melhores or nota > lista_roteiros[melhores[-1]][1]:
+                    melhores.append(posicao)
+                else:
+                    melhores.append(melhores[-1])
+            cidades[cidade] = {
+                "hoteis": lista_hoteis,
+                "precos_roteiros": [item[0] for item in lista_roteiros],
+                "roteiros": lista_roteiros,
+                "melhores": melhores,
+                "nota_maxima_roteiro": lista_roteiros[melhores[-1]][1],
+                "nota_maxima": max(item[1] for item in lista_hoteis) + lista_roteiros[melhores[-1]][1],
+            }
+
+        with self._lock:
+            self._cidades, self._versoes = cidades, versoes
+        return cidades
+
+    def melhor_pacote(self, origem, orcamento, destino=None):
+        catalogo = self._catalogo()
+        voos = self.flight_manager.voos_mais_baratos(origem)
+        if destino is not None:
+            voos = {chave: voo for chave, voo in voos.items() if chave == normalizar_cidade(destino)}
+
+        # Cidades com a maior nota possível primeiro: quando nem o teto de uma cidade
+        # alcança o melhor pacote encontrado, as seguintes também não alcançam
+        candidatas = sorted(
+            (cidade for cidade in voos if cidade in catalogo),
+            key=lambda cidade: -catalogo[cidade]["nota_maxima"],
+        )
+        melhor = None
+        for cidade in candidatas:
+            dados = catalogo[cidade]
+            if melhor is not None and dados["nota_maxima"] < melhor[0]:
+                break
+            voo = voos[cidade]
+            restante = orcamento - voo["valor_voo"]
+            for preco_hotel, nota_hotel, hotel in dados["hoteis"]:
+                if preco_hotel > restante:
+                    break
+                posicao = bisect.bisect_right(dados["precos_roteiros"], restante - preco_hotel) - 1
+                if posicao < 0:
+                    break
+                if melhor is not None and nota_hotel + dados["nota_maxima_roteiro"] < melhor[0]:
+                    continue
+                preco_roteiro, nota_roteiro, roteiro = dados["roteiros"][dados["melhores"][posicao]]
+                total = voo["valor_voo"] + preco_hotel + preco_roteiro
+                candidato = (nota_hotel + nota_roteiro, -total, voo, hotel, roteiro)
+                if melhor is None or candidato[:2] > melhor[:2]:
+                    melhor = candidato
+
+        if melhor is None:
+            return None
+        nota, total, voo, hotel, roteiro = melhor
+        return {
+            "nota": nota,
+            "valor_total": -total,
+            "orcamento_restante": orcamento + total,
+            "dados_voo": voo,
+            "dados_hotel": hotel,
+            "dados_roteiro": roteiro["dados_roteiro"],
+        }
+
+if os.environ.get("STORAGE_BACKEND") == "sqlite":
+    store = SQLiteStore(os.environ.get("SQLITE_FILE", "viagens.db"))
+else:
+    store = None
+
+flight_manager = FlightManagement(store=store)
+itinerary_manager = ItineraryManagement(store=store)
+if os.environ.get("USER_STORAGE") == "log":
+    user_manager = UserLogManagement()
+    user_manager.start_compaction()
+else:
+    user_manager = UserManagement(store=store)
+city_manager = CityInformation(
+    store=store,
+    gazetteer=Gazetteer(os.environ.get("GAZETTEER_FILE", "gazetteer_cidades.json")),
+    endpoint=os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search"),
+    hedge_after=float(os.environ["GEOCODER_HEDGE_AFTER"]) if os.environ.get("GEOCODER_HEDGE_AFTER") else None,
+)
+
+prefetcher = CoordinatePrefetcher(city_manager, [
+    lambda: (destino.get("cidade") for destino in city_manager.read_records()),
+    lambda: (roteiro.get("dados_roteiro", {}).get("nome_da_cidade") for roteiro in itinerary_manager.read_records()),
+    lambda: (cidade for voo in flight_manager.read_records() for cidade in (voo.get("origem"), voo.get("destino"))),
+])
+
+destination_table = DestinationTable(city_manager, prefetcher)
+map_index = MapIndex(city_manager, itinerary_manager, prefetcher)
+bundle_optimizer = BundleOptimizer(flight_manager, itinerary_manager, user_manager)
 
 # Definição dos endpoints FastAPI
 app = FastAPI()
 
+@app.on_event("startup")
+def iniciar_prefetch():
+    prefetcher.start()
+
+@app.on_event("shutdown")
+def parar_prefetch():
+    prefetcher.stop()
+
 @app.post("/itineraries/add")
 def adicionar_roteiro(dados_roteiro: dict):
-    roteiros = itinerary_manager.carregar_roteiros()
-    roteiros["roteiros"].append(dados_roteiro)
-    itinerary_manager.salvar_roteiros(roteiros)
+    itinerary_manager.adicionar_roteiro(dados_roteiro)
+    map_index.adicionar_roteiro(dados_roteiro)
+    prefetcher.agendar([dados_roteiro.get("dados_roteiro", {}).get("nome_da_cidade")])
     return {"message": "Roteiro adicionado com sucesso!"}
 
 @app.get("/itineraries/search-itineraries/{nome_da_cidade}")
 def buscar_roteiro(nome_da_cidade: str):
-    roteiros = itinerary_manager.carregar_roteiros()["roteiros"]
-    roteiros_cidade = [r for r in roteiros if r["dados_roteiro"]["nome_da_cidade"] == nome_da_cidade]
+    roteiros_cidade = itinerary_manager.roteiros_da_cidade(nome_da_cidade)
     if not roteiros_cidade:
         raise HTTPException(status_code=404, detail="Roteiro não encontrado")
-    roteiro_maior_nota = max(roteiros_cidade, key=lambda x: x["dados_roteiro"]["nota"])
     return roteiros_cidade
 
 @app.get("/maps/coordinates/")
-def get_coordenadas(cidade_origem: str, cidade_destino: str):
-    # Obter coordenadas das cidades
-    coordenadas_origem = city_manager.get_coordinates(cidade_origem)
-    coordenadas_destino = city_manager.get_coordinates(cidade_destino)
+async def get_coordenadas(cidade_origem: str, cidade_destino: str):
+    # Obter coordenadas das duas cidades ao mesmo tempo
+    try:
+        coordenadas_origem, coordenadas_destino = await asyncio.gather(
+            city_manager.get_coordinates_async(cidade_origem),
+            city_manager.get_coordinates_async(cidade_destino),
+        )
+    except (asyncio.TimeoutError, requests.RequestException):
+        raise HTTPException(status_code=504, detail="Tempo esgotado ao buscar as coordenadas")
 
     # Gere o link para o Google Maps com as coordenadas diretamente
     mapa_origem = f"https://www.google.com/maps/place/{coordenadas_origem[0]},{coordenadas_origem[1]}"
@@ -215,6 +2470,145 @@ def get_coordenadas(cidade_origem: str, cidade_destino: str):
         ]   
     }
 
+@app.post("/maps/coordinates/batch")
+async def get_coordenadas_lote(dados: dict):
+    cidades = dados.get("cidades")
+    if not isinstance(cidades, list) or not all(isinstance(cidade, str) for cidade in cidades):
+        raise HTTPException(status_code=400, detail="Informe 'cidades' como uma lista de nomes")
+
+    # Remove cidades repetidas (mesmo nome normalizado), mantendo a primeira grafia
+    unicas = {}
+    for cidade in cidades:
+        unicas.setdefault(normalizar_cidade(cidade), cidade)
+    cidades = list(unicas.values())
+    if len(cidades) > 100:
+        raise HTTPException(status_code=400, detail="Máximo de 100 cidades por consulta")
+
+    # Gazetteer e cache respondem na hora; das cidades que precisam do Nominatim (uma
+    # por segundo) só as primeiras 5 são buscadas agora, as demais vão para o prefetch
+    resultados = {}
+    remotas = []
+    for cidade in cidades:
+        try:
+            coordenadas = city_manager.coordenadas_em_cache(cidade)
+        except ValueError as e:
+            resultados[cidade] = e
+            continue
+        if coordenadas is not None:
+            resultados[cidade] = coordenadas
+        else:
+            remotas.append(cidade)
+    pendentes = remotas[5:]
+    remotas = remotas[:5]
+    if pendentes:
+        prefetcher.agendar(pendentes)
+
+    buscadas = await asyncio.gather(
+        *(city_manager.get_coordinates_batch_async(cidade) for cidade in remotas), return_exceptions=True
+    )
+    resultados.update(zip(remotas, buscadas))
+
+    resposta = []
+    for cidade in cidades:
+        resultado = resultados.get(cidade)
+        if resultado is None:
+            resposta.append({"cidade": cidade, "pendente": True})
+        elif isinstance(resultado, BaseException):
+            erro = resultado.detail if isinstance(resultado, HTTPException) else str(resultado) or "Tempo esgotado"
+            resposta.append({"cidade": cidade, "erro": erro})
+        else:
+            latitude, longitude = resultado
+            mapa = f"https://www.google.com/maps/place/{latitude},{longitude}"
+            resposta.append({"cidade": cidade, "coordenadas": {"latitude": latitude, "longitude": longitude, "mapa_link": mapa}})
+
+    # Matriz de distâncias na ordem da lista de cidades; None quando faltam coordenadas
+    resolvidas = [i for i, cidade in enumerate(resposta) if "coordenadas" in cidade]
+    matriz = matriz_distancias_km(
+        [resposta[i]["coordenadas"]["latitude"] for i in resolvidas],
+        [resposta[i]["coordenadas"]["longitude"] for i in resolvidas],
+    )
+    distancias = [[None] * len(resposta) for _ in resposta]
+    for linha, i in enumerate(resolvidas):
+        for coluna, j in enumerate(resolvidas):
+            distancias[i][j] = float(matriz[linha][coluna])
+
+    return {"cidades": resposta, "distancias_km": distancias}
+
+@app.get("/maps/reverse-geocode")
+def get_cidades_proximas_do_ponto(latitude: float, longitude: float, limite: int = 1):
+    # Geocodificação reversa offline: cidades do gazetteer mais próximas do ponto (KD-tree)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Coordenadas inválidas")
+    if not 1 <= limite <= 50:
+        raise HTTPException(status_code=400, detail="O limite deve estar entre 1 e 50")
+
+    cidades = city_manager.gazetteer.mais_proximas(latitude, longitude, limite)
+    if not cidades:
+        raise HTTPException(status_code=404, detail="Nenhuma cidade no gazetteer")
+    return {"coordenadas": {"latitude": latitude, "longitude": longitude}, "cidades": cidades}
+
+@app.get("/maps/nearby/{cidade}")
+async def get_destinos_proximos(cidade: str, raio_km: float = None, limite: int = 10):
+    if limite < 1:
+        raise HTTPException(status_code=400, detail="O limite deve ser maior que zero")
+    try:
+        latitude, longitude = await city_manager.get_coordinates_async(cidade)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Tempo esgotado ao buscar as coordenadas")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    destinos = await run_in_threadpool(
+        destination_table.proximos, latitude, longitude, raio_km, limite, normalizar_cidade(cidade)
+    )
+    return {
+        "cidade": cidade,
+        "coordenadas": {"latitude": latitude, "longitude": longitude},
+        "destinos": destinos,
+    }
+
+@app.get("/maps/search/bbox")
+def buscar_no_mapa(min_lat: float, min_lon: float, max_lat: float, max_lon: float, limite: int = 100):
+    if not (-90 <= min_lat <= max_lat <= 90) or not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise HTTPException(status_code=400, detail="Área inválida: latitudes entre -90 e 90 e longitudes entre -180 e 180")
+    if limite < 1:
+        raise HTTPException(status_code=400, detail="O limite deve ser maior que zero")
+    return map_index.bbox(min_lat, min_lon, max_lat, max_lon, limite)
+
+@app.get("/maps/search/radius")
+def buscar_no_raio(latitude: float, longitude: float, raio_km: float, limite: int = 100):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Coordenadas inválidas")
+    if raio_km <= 0 or limite < 1:
+        raise HTTPException(status_code=400, detail="O raio e o limite devem ser maiores que zero")
+    return map_index.raio(latitude, longitude, raio_km, limite)
+
+@app.get("/maps/clusters")
+def get_clusters(zoom: int, bbox: str = None):
+    # bbox no formato min_lon,min_lat,max_lon,max_lat (oeste, sul, leste, norte)
+    if not 0 <= zoom <= map_index.pyramid.max_zoom:
+        raise HTTPException(status_code=400, detail=f"O zoom deve estar entre 0 e {map_index.pyramid.max_zoom}")
+    area = (-180.0, -90.0, 180.0, 90.0)
+    if bbox is not None:
+        try:
+            area = tuple(float(valor) for valor in bbox.split(","))
+        except ValueError:
+            area = ()
+        if len(area) != 4 or not (-90 <= area[1] <= area[3] <= 90) or not all(-180 <= area[i] <= 180 for i in (0, 2)):
+            raise HTTPException(status_code=400, detail="bbox inválido, use min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = area
+
+    clusters = map_index.clusters(zoom, min_lat, min_lon, max_lat, max_lon)
+    return {"zoom": zoom, "total": len(clusters), "clusters": clusters}
+
+@app.get("/maps/geocoder/metrics")
+def get_metricas_geocodificador():
+    return {
+        **city_manager.scheduler.metricas(),
+        "circuito": city_manager.breaker.estado(),
+        "prefetch": prefetcher.status(),
+    }
+
 @app.get("/cidade/{nome_cidade}")
 def get_informacoes_cidade(nome_cidade: str):
     try:
@@ -240,7 +2634,7 @@ async def get_user(user_id: str = Path(..., description="ID do usuário")):
         return {"error": str(e)}
 
 @app.post("/user/add")
-async def add_user(user_data: dict):
+def add_user(user_data: dict):
     user_id = user_manager.generate_user_id()
 
     # Adicionando os novos campos e valores
@@ -255,19 +2649,20 @@ async def add_user(user_data: dict):
 
     user_data["id_usuario"] = user_id
 
-    # Lendo os usuários existentes
-    users = user_manager.read_users()
-
-    # Adicionando o novo usuário à lista de usuários
-    users.append(user_data)
-
-    # Escrevendo a lista atualizada de usuários de volta ao arquivo
-    user_manager.write_users(users)
+    # Gravando o novo usuário
+    user_manager.insert_user(user_data)
 
     return {"message": "Usuário adicionado com sucesso!", "id_usuario": user_id}
 
+@app.get("/user/by-email/{email}")
+async def get_user_by_email(email: str):
+    user_info = user_manager.get_user_by_email(email)
+    if user_info is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    return {"user_info": user_info}
+
 @app.post("/user/update/{user_id}")
-async def update_user_endpoint(user_id: str, updated_data: dict):
+def update_user_endpoint(user_id: str, updated_data: dict):
     return user_manager.update_user(user_id, updated_data)
 
 @app.get("/cidade/{nome_cidade}")
@@ -279,7 +2674,7 @@ def get_informacoes_cidade(nome_cidade: str):
         return {"Informação não encontrada": str(e)}
     
 @app.post("/user/delete/{user_id}")
-async def delete_user_endpoint(user_id: str):
+def delete_user_endpoint(user_id: str):
     return user_manager.delete_user(user_id)
 
 @app.get("/user/personalized-recommendations/{user_id}")
@@ -287,28 +2682,97 @@ async def personalized_recommendations_endpoint(user_id: str):
     return itinerary_manager.personalized_recommendations(user_id)
 
 @app.post("/user/copy-itinerary/{id_usuario_1}/{id_usuario_2}")
-async def copy_itinerary_endpoint(id_usuario_1: str, id_usuario_2: str):
+def copy_itinerary_endpoint(id_usuario_1: str, id_usuario_2: str):
     return user_manager.copy_itinerary(id_usuario_1, id_usuario_2)
 
-@app.post("/flights/add")
-def adicionar_dados_voo(dados_voo: dict):
-    voos_data = flight_manager.carregar_data()
-    dados_voo_key = "dados_voo"
-    if dados_voo_key not in voos_data:
-        voos_data[dados_voo_key] = []
+@app.get("/trips/best-bundle/{origem}")
+def buscar_melhor_pacote(origem: str, orcamento: float, destino: str = None):
+    if orcamento < 0:
+        raise HTTPException(status_code=400, detail="O orçamento não pode ser negativo")
 
-    voos_data[dados_voo_key].append(dados_voo)
+    pacote = bundle_optimizer.melhor_pacote(origem, orcamento, destino)
+    if pacote is None:
+        raise HTTPException(status_code=404, detail="Nenhum pacote encontrado dentro do orçamento")
+    return pacote
 
-    flight_manager.salvar_data(voos_data)
+@app.post("/flights/add")
+def adicionar_dados_voo(dados_voo: dict):
+    flight_manager.adicionar_voo(dados_voo)
+    prefetcher.agendar([dados_voo.get("origem"), dados_voo.get("destino")])
     
     return {"message": "Dados de voo adicionados com sucesso!"}
 
 
+@app.get("/flights/routes/{origem}/{destino}")
+def buscar_rotas(origem: str, destino: str, max_trechos: int = 3, k: int = 1):
+    if normalizar_cidade(origem) == normalizar_cidade(destino):
+        raise HTTPException(status_code=400, detail="Origem e destino devem ser diferentes")
+    if not 1 <= max_trechos <= 6 or not 1 <= k <= 10:
+        raise HTTPException(status_code=400, detail="Use max_trechos entre 1 e 6 e k entre 1 e 10")
+
+    rotas = flight_manager.rotas_mais_baratas(origem, destino, max_trechos, k)
+    if not rotas:
+        raise HTTPException(status_code=404, detail="Nenhuma rota encontrada")
+    return {"origem": origem, "destino": destino, "rotas": rotas}
+
+@app.get("/flights/earliest-arrival/{origem}/{destino}")
+def buscar_chegada_mais_cedo(origem: str, destino: str, data_inicio: str = None, min_conexao_dias: int = 1):
+    if normalizar_cidade(origem) == normalizar_cidade(destino):
+        raise HTTPException(status_code=400, detail="Origem e destino devem ser diferentes")
+    if not 0 <= min_conexao_dias <= 30:
+        raise HTTPException(status_code=400, detail="min_conexao_dias deve estar entre 0 e 30")
+    try:
+        inicio = flight_manager.parse_data(data_inicio) if data_inicio else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida, use o formato dd/mm/aaaa")
+
+    voos = flight_manager.viagem_mais_rapida(origem, destino, inicio, min_conexao_dias)
+    if not voos:
+        raise HTTPException(status_code=404, detail="Nenhuma viagem encontrada")
+    return {
+        "origem": origem,
+        "destino": destino,
+        "partida": voos[0]["data_da_partida"],
+        "chegada": voos[-1]["data_da_partida"],
+        "escalas": len(voos) - 1,
+        "voos": voos,
+    }
+
+@app.get("/flights/anywhere/{origem}")
+def buscar_destinos_mais_baratos(origem: str, max_price: float = None, month: str = None):
+    # month no formato mm/aaaa, como a data_da_partida
+    try:
+        mes = datetime.strptime(month, "%m/%Y") if month else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mês inválido, use o formato mm/aaaa")
+
+    voos = flight_manager.destinos_mais_baratos(origem, (mes.year, mes.month) if mes else None, max_price)
+    if not voos:
+        raise HTTPException(status_code=404, detail="Nenhum destino encontrado")
+    return {
+        "origem": origem,
+        "destinos": [{"destino": voo["destino"], "valor_voo": voo["valor_voo"], "dados_voo": voo} for voo in voos],
+    }
+
+@app.get("/flights/reachable/{origem}")
+def buscar_destinos_alcancaveis(origem: str, orcamento: float, max_trechos: int = 3):
+    if orcamento < 0 or not 1 <= max_trechos <= 6:
+        raise HTTPException(status_code=400, detail="Use um orçamento positivo e max_trechos entre 1 e 6")
+
+    destinos = flight_manager.destinos_alcancaveis(origem, orcamento, max_trechos)
+    if not destinos:
+        raise HTTPException(status_code=404, detail="Nenhum destino alcançável dentro do orçamento")
+    return {"origem": origem, "orcamento": orcamento, "destinos": destinos}
+
 @app.get("/flights/search-flights/{nome_da_cidade}")
-def buscar_roteiro(nome_da_cidade: str):
-    voos_data = flight_manager.carregar_data()["dados_voo"]
-    
-    dados_voo_cidade = [r for r in voos_data if "origem" in r and r["origem"] == nome_da_cidade]
+def buscar_roteiro(nome_da_cidade: str, destino: str = None, data_inicio: str = None, data_fim: str = None):
+    try:
+        inicio = flight_manager.parse_data(data_inicio) if data_inicio else None
+        fim = flight_manager.parse_data(data_fim) if data_fim else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida, use o formato dd/mm/aaaa")
+
+    dados_voo_cidade = flight_manager.buscar_voos(nome_da_cidade, destino, inicio, fim)
     
     if not dados_voo_cidade:
         raise HTTPException(status_code=404, detail="Dados voo não encontrado")
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+class NominatimStub(BaseHTTPRequestHandler):
+    # Cada teste define a resposta em NominatimStub.resposta = (status, corpo)
+    resposta = (200, [])
+
+    def do_GET(self):
+        status, corpo = self.resposta
+        conteudo = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nominatim():
+    servidor = HTTPServer(("127.0.0.1", 0), NominatimStub)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{servidor.server_port}/search"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def city_manager(nominatim, tmp_path):
+    return main.CityInformation(
+        city_file=str(tmp_path / "informacoes_destinos.json"),
+        coordinate_cache=main.CoordinateCache(str(tmp_path / "cache_coordenadas.json")),
+        gazetteer=main.Gazetteer(str(tmp_path / "gazetteer_cidades.json")),
+        timeout=2,
+        scheduler=main.OutboundScheduler(rate=1000, burst=1000),
+        endpoint=nominatim,
+        breaker=main.CircuitBreaker(failure_threshold=1, reset_timeout=0),
+    )
+
+
+def test_falha_abre_o_circuito(city_manager):
+    NominatimStub.resposta = (500, {"erro": "indisponível"})
+    with pytest.raises(main.HTTPException) as erro:
+        city_manager.get_coordinates("Cidade Inexistente")
+    assert erro.value.status_code == 503
+    assert city_manager.breaker.estado()["estado"] == main.CircuitBreaker.ABERTO
+
+
+def test_resposta_inesperada_na_chamada_de_teste_nao_trava_o_circuito(city_manager):
+    NominatimStub.resposta = (500, {})
+    with pytest.raises(main.HTTPException):
+        city_manager.get_coordinates("Cidade Um")
+
+    # A chamada de teste (meio aberto) recebe um payload sem a lista de resultados
+    NominatimStub.resposta = (200, {"error": "Unable to geocode"})
+    with pytest.raises(KeyError):
+        city_manager.get_coordinates("Cidade Dois")
+    assert city_manager.breaker.estado()["estado"] == main.CircuitBreaker.ABERTO
+
+    # Com o Nominatim de volta, a próxima chamada de teste fecha o circuito
+    NominatimStub.resposta = (200, [{"lat": "-10.184", "lon": "-48.3336"}])
+    assert city_manager.get_coordinates("Cidade Tres") == (-10.184, -48.3336)
+    assert city_manager.breaker.estado()["estado"] == main.CircuitBreaker.FECHADO
+
+
+def test_cidade_nao_encontrada_fecha_o_circuito(city_manager):
+    NominatimStub.resposta = (200, [])
+    with pytest.raises(ValueError):
+        city_manager.get_coordinates("Lugar Nenhum")
+    assert city_manager.breaker.estado()["estado"] == main.CircuitBreaker.FECHADO
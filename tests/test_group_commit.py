@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+import threading
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def novo_usuario(numero):
+    return {
+        "dados_do_usuario": {"nome_completo": f"Usuario {numero}", "email": f"usuario{numero}@teste.com", "valor_total": 0},
+        "dados_voo": {"valor_voo": 100, "origem": "Palmas", "destino": "Recife", "data_da_partida": "15/01/2023"},
+        "dados_hotel": {"valor_hotel": 200, "nome_da_cidade": "Recife", "nota": 4},
+        "dados_roteiro": {"valor_roteiro": 50, "nome_da_cidade": "Recife", "nota": 3},
+    }
+
+
+def test_usuarios_adicionados_juntos_dividem_a_reescrita(monkeypatch, tmp_path):
+    arquivo = tmp_path / "usuarios.json"
+    arquivo.write_text("[]", encoding="utf-8")
+    # Janela maior que a padrão para o teste não depender da velocidade da máquina
+    user_manager = main.UserManagement(str(arquivo))
+    user_manager.commit_window = 0.05
+
+    reescritas = []
+    write_file = user_manager._write_file
+    def contar_reescrita(content):
+        reescritas.append(threading.get_ident())
+        write_file(content)
+    monkeypatch.setattr(user_manager, "_write_file", contar_reescrita)
+    monkeypatch.setattr(main, "user_manager", user_manager)
+
+    # Um único event loop, como no servidor: endpoints que bloqueiam o loop gravariam um por vez
+    async def enviar(total):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://teste") as client:
+            return await asyncio.gather(*(client.post("/user/add", json=novo_usuario(numero)) for numero in range(total)))
+
+    total = 20
+    respostas = asyncio.run(enviar(total))
+
+    assert all(resposta.status_code == 200 for resposta in respostas)
+    assert len(user_manager.read_users()) == total
+    assert len(reescritas) < total